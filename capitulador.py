@@ -1,16 +1,32 @@
+import hashlib
+import ipaddress
+import json
 import logging
+import mmap
 import os
 import platform
 import re
+import select
 import shutil
+import signal
+import socket
+import socketserver
+import struct
 import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar, copy_context
 from datetime import datetime
+from functools import lru_cache
 from pathlib import Path
-from typing import List
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, TextIO
 
-import panflute as pf
-
-from config.config import settings
+from config.config import settings, settings_provider
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
@@ -21,6 +37,8 @@ class CapituladorError(Exception):
 
 
 class FileHandler:
+    COMPARE_BLOCK_SIZE = 1024 * 1024
+
     @staticmethod
     def read_file(file_path: str, encoding: str = "utf-8") -> str:
         try:
@@ -40,15 +58,72 @@ class FileHandler:
     @staticmethod
     def write_file(file_path: str, content: str, encoding: str = "utf-8") -> None:
         try:
-            Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(file_path, "w", encoding=encoding) as file:
+            with FileHandler.atomic_writer(file_path, "w", encoding) as file:
                 file.write(content)
-                logger.info(f"Archivo escrito: {file_path}")
+            logger.info(f"Archivo escrito: {file_path}")
+        except Exception as e:
+            error_msg = f"Error escribiendo archivo {file_path}: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+    
+    @staticmethod
+    def write_lines(file_path: str, lines: Iterable[str], encoding: str = "utf-8") -> None:
+        try:
+            with FileHandler.atomic_writer(file_path, "w", encoding) as file:
+                for position, line in enumerate(lines):
+                    file.write(line if position == 0 else f"\n{line}")
+            logger.info(f"Archivo escrito: {file_path}")
+        except Exception as e:
+            error_msg = f"Error escribiendo archivo {file_path}: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+    
+    @staticmethod
+    def write_if_changed(file_path: str, content: Any, encoding: str = "utf-8") -> bool:
+        if isinstance(content, str):
+            content = content.replace("\n", os.linesep).encode(encoding)
+        data = memoryview(content)
+        path = Path(file_path)
+        if FileHandler._has_content(path, data):
+            return False
+
+        try:
+            with FileHandler.atomic_writer(file_path, "wb") as file:
+                file.write(data)
+            return True
         except Exception as e:
             error_msg = f"Error escribiendo archivo {file_path}: {e}"
             logger.error(error_msg)
             raise CapituladorError(error_msg)
     
+    @staticmethod
+    @contextmanager
+    def atomic_writer(file_path: str, mode: str = "w", encoding: str = "utf-8") -> Iterator[Any]:
+        # Nunca se escribe sobre el archivo existente: puede ser un enlace duro a la caché.
+        path = Path(file_path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temp_path = path.with_name(f"{path.name}.{os.getpid()}.{threading.get_ident()}.tmp")
+        try:
+            with open(temp_path, mode, encoding=None if "b" in mode else encoding) as file:
+                yield file
+            os.replace(temp_path, path)
+        except BaseException:
+            temp_path.unlink(missing_ok=True)
+            raise
+    
+    @staticmethod
+    def _has_content(path: Path, data: memoryview) -> bool:
+        try:
+            if path.stat().st_size != data.nbytes:
+                return False
+            with open(path, "rb") as file:
+                for start in range(0, data.nbytes, FileHandler.COMPARE_BLOCK_SIZE):
+                    if file.read(FileHandler.COMPARE_BLOCK_SIZE) != data[start:start + FileHandler.COMPARE_BLOCK_SIZE]:
+                        return False
+            return True
+        except OSError:
+            return False
+    
     @staticmethod
     def ensure_directory_exists(directory: str) -> None:
         try:
@@ -60,70 +135,729 @@ class FileHandler:
             raise CapituladorError(error_msg)
 
 
+class IndexedChapter:
+    def __init__(self, number: int, start: int, line_start: int, header_line: int):
+        self.number = number
+        self.title: Optional[str] = None
+        self.start = start
+        self.end = start
+        self.line_start = line_start
+        self.line_end = line_start
+        self.header_line = header_line
+        self.words = 0
+        self.hash = ""
+
+
+class ManuscriptIndex:
+    CHAPTER_PATTERN = re.compile(r"# Chapter (\d+)")
+    BYTE_HEADER_PATTERN = re.compile(b"^" + CHAPTER_PATTERN.pattern.encode("ascii"), re.MULTILINE)
+    TITLE_PATTERN = re.compile(r"## (.*\S)")
+    WORD_PATTERN = re.compile(r"\b\w+\b")
+
+    def __init__(self, text: str):
+        self.text = text
+        self.chapters: List[IndexedChapter] = []
+        self.line_words: List[int] = []
+        self.title_lines: List[tuple] = []
+        self.blank_runs: List[tuple] = []
+        self.newpages: List[int] = []
+        self.vspaces: List[int] = []
+        self.words = 0
+        self._build()
+
+    def chapter_texts(self) -> List[str]:
+        return [self.text[chapter.start:chapter.end] for chapter in self.chapters]
+
+    @staticmethod
+    def byte_offsets(data: Any) -> List[int]:
+        # Sobre los bytes crudos: así los desplazamientos valen también para archivos CRLF.
+        return [match.start() for match in ManuscriptIndex.BYTE_HEADER_PATTERN.finditer(data)]
+
+    @staticmethod
+    def scan_line(line: str) -> tuple:
+        marker = ManuscriptIndex.CHAPTER_PATTERN.match(line)
+        title = None if marker else ManuscriptIndex.TITLE_PATTERN.match(line)
+        return (int(marker.group(1)) if marker else None, title.group(1) if title else None,
+                len(ManuscriptIndex.WORD_PATTERN.findall(line)))
+
+    def _build(self) -> None:
+        # Lo anterior al primer capítulo pertenece a él, igual que al generar los capítulos.
+        offset = words = 0
+        blank_start = None
+        chapter = None
+
+        lines = self.text.split("\n")
+        for line_number, line in enumerate(lines):
+            number, title, line_words = self.scan_line(line)
+            if number is not None:
+                if chapter is not None:
+                    self._close_chapter(chapter, offset, line_number, words)
+                    chapter = IndexedChapter(number, offset, line_number, line_number)
+                    words = 0
+                else:
+                    chapter = IndexedChapter(number, 0, 0, line_number)
+                self.chapters.append(chapter)
+            elif title is not None:
+                self.title_lines.append((line_number, title))
+                if chapter is not None and chapter.title is None:
+                    chapter.title = title
+
+            stripped = line.strip()
+            if stripped:
+                if blank_start is not None:
+                    self.blank_runs.append((blank_start, line_number - blank_start))
+                    blank_start = None
+                if stripped == r"\newpage":
+                    self.newpages.append(line_number)
+                elif stripped.startswith(r"\vspace"):
+                    self.vspaces.append(line_number)
+            elif blank_start is None:
+                blank_start = line_number
+
+            self.line_words.append(line_words)
+            words += line_words
+            offset += len(line) + 1
+
+        if blank_start is not None:
+            self.blank_runs.append((blank_start, len(lines) - blank_start))
+        if chapter is not None:
+            self._close_chapter(chapter, len(self.text), len(lines), words)
+        self.words = sum(self.line_words)
+
+    def _close_chapter(self, chapter: IndexedChapter, end: int, line_end: int, words: int) -> None:
+        chapter.end = end
+        chapter.line_end = line_end
+        chapter.words = words
+        chapter.hash = hashlib.sha256(self.text[chapter.start:end].encode("utf-8")).hexdigest()
+
+
+class Manuscript:
+    def __init__(self, data: Any, path: Optional[str] = None, encoding: str = "utf-8"):
+        self.path = path
+        self.data = data
+        self.encoding = encoding
+        self._text: Optional[str] = None
+        self._hash: Optional[str] = None
+        self._index: Optional[ManuscriptIndex] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = str(self.data, self.encoding).replace("\r\n", "\n").replace("\r", "\n")
+        return self._text
+
+    @property
+    def hash(self) -> str:
+        if self._hash is None:
+            self._hash = hashlib.sha256(self.data).hexdigest()
+        return self._hash
+
+    @property
+    def index(self) -> ManuscriptIndex:
+        if self._index is None:
+            self._index = ManuscriptIndex(self.text)
+        return self._index
+
+    def iter_lines(self) -> Iterator[str]:
+        if self._text is not None:
+            yield from self._text.splitlines()
+            return
+        start = 0
+        while start < len(self.data):
+            end = self.data.find(b"\n", start)
+            end = len(self.data) if end < 0 else end + 1
+            yield from str(self.data[start:end], self.encoding).splitlines()
+            start = end
+
+    def close(self) -> None:
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+
+    @classmethod
+    def load(cls, file_path: str, use_mmap: Optional[bool] = None, encoding: str = "utf-8") -> "Manuscript":
+        try:
+            with open(file_path, "rb") as file:
+                size = os.fstat(file.fileno()).st_size
+                if use_mmap is None:
+                    use_mmap = size >= settings.MANUSCRIPT_MMAP_THRESHOLD
+                if use_mmap and size:
+                    data = cls._map_snapshot(file)
+                else:
+                    data = file.read()
+            manuscript = cls(data, file_path, encoding)
+            logger.info(f"Manuscrito cargado: {file_path}")
+            return manuscript
+        except FileNotFoundError:
+            error_msg = f"Archivo no encontrado: {file_path}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+        except Exception as e:
+            error_msg = f"Error leyendo archivo {file_path}: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+    @staticmethod
+    def _map_snapshot(file: Any) -> Any:
+        # Se mapea una copia propia: si se guarda o trunca el original durante la construcción,
+        # las etapas siguen viendo el mismo texto (y no hay SIGBUS).
+        folder = Path(settings.CACHE_FOLDER)
+        folder.mkdir(parents=True, exist_ok=True)
+        for _ in range(3):
+            before = os.fstat(file.fileno())
+            file.seek(0)
+            with tempfile.TemporaryFile(dir=folder) as snapshot:
+                shutil.copyfileobj(file, snapshot, FileHandler.COMPARE_BLOCK_SIZE)
+                snapshot.flush()
+                after = os.fstat(file.fileno())
+                if (before.st_size, before.st_mtime_ns) != (after.st_size, after.st_mtime_ns):
+                    continue
+                if not after.st_size:
+                    return b""
+                return mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        raise CapituladorError("El manuscrito cambió mientras se leía")
+
+    @classmethod
+    def from_text(cls, text: str, path: Optional[str] = None) -> "Manuscript":
+        manuscript = cls(text.encode("utf-8"), path)
+        if "\r" not in text:
+            manuscript._text = text
+        return manuscript
+
+    def chapters(self) -> List[str]:
+        return self.index.chapter_texts()
+
+
 class ContentProcessor:
     @staticmethod
     def process_content(content: str) -> str:
-        lines = content.splitlines()
-        new_content = []
+        processed_content = "\n".join(ContentProcessor.iter_processed_lines(content.splitlines()))
+        logger.info("Contenido procesado")
+        return processed_content
 
-        for i, line in enumerate(lines):
-            if line.strip():
-                new_content.append(line)
-                if i < len(lines) - 1:
-                    if lines[i + 1].strip():
-                        new_content.append("")
-                    else:
-                        skip_lines = ContentProcessor._count_empty_lines(lines, i + 1)
-                        ContentProcessor._add_spacing(new_content, skip_lines)
+    @staticmethod
+    def iter_processed_lines(lines: Iterable[str]) -> Iterator[str]:
+        empty_lines = 0
+        started = False
+
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                empty_lines += started
+                continue
+            if started:
+                yield from ContentProcessor._spacing(empty_lines)
+            yield line
+            started = True
+            empty_lines = 0
+
+        if empty_lines:
+            yield from ContentProcessor._spacing(empty_lines)
 
-        logger.info("Contenido procesado")
-        return "\n".join(new_content)
-    
     @staticmethod
-    def _count_empty_lines(lines: List[str], start_index: int) -> int:
-        skip_lines = 0
-        j = start_index
-        while j < len(lines) and not lines[j].strip():
-            skip_lines += 1
-            j += 1
-        return skip_lines
-    
+    def tee_lines(lines: Iterable[str], output: TextIO) -> Iterator[str]:
+        for position, line in enumerate(lines):
+            output.write(line if position == 0 else f"\n{line}")
+            yield line
+
     @staticmethod
-    def _add_spacing(content_list: List[str], skip_lines: int) -> None:
-        if skip_lines == 1:
-            content_list.append("")
+    def _spacing(skip_lines: int) -> List[str]:
+        if skip_lines <= 1:
+            return [""]
         elif skip_lines == 2:
-            content_list.extend(["", r"\vspace{12pt}", ""])
-        elif skip_lines >= 3:
-            content_list.extend(["", r"\newpage", ""])
+            return ["", r"\vspace{12pt}", ""]
+        return ["", r"\newpage", ""]
+
+
+class ToolVersions:
+    # Se guardan por ruta y fecha del ejecutable para no lanzar "--version" en cada proceso.
+    _lock = threading.Lock()
+
+    def __init__(self, cache_folder: Optional[str] = None):
+        self.cache_file = Path(cache_folder or settings.CACHE_FOLDER) / "tools.json"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def version(command: str) -> str:
+        return ToolVersions().lookup(command)
+
+    def lookup(self, command: str) -> str:
+        executable = shutil.which(command)
+        if executable is None:
+            return ""
+        try:
+            stat = os.stat(executable)
+        except OSError:
+            return ""
+        key = f"{executable}|{stat.st_mtime_ns}|{stat.st_size}"
+
+        with ToolVersions._lock:
+            try:
+                versions = json.loads(self.cache_file.read_text(encoding="utf-8"))
+            except (OSError, ValueError):
+                versions = {}
+            if key in versions:
+                return versions[key]
+
+            try:
+                result = subprocess.run([executable, "--version"], check=True, capture_output=True, text=True)
+                versions[key] = result.stdout.splitlines()[0]
+            except (OSError, subprocess.CalledProcessError, IndexError):
+                return ""
+            try:
+                FileHandler.write_if_changed(str(self.cache_file), json.dumps(versions, indent=2))
+            except CapituladorError:
+                pass
+            return versions[key]
+
+
+class LatexCache:
+    def __init__(self, cache_folder: Optional[str] = None):
+        self.cache_folder = Path(cache_folder or settings.CACHE_FOLDER) / "latex"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def tool_versions() -> str:
+        from importlib.metadata import PackageNotFoundError, version
+
+        try:
+            panflute_version = version("panflute")
+        except PackageNotFoundError:
+            panflute_version = "desconocido"
+        return f"{ToolVersions.version('pandoc') or 'pandoc desconocido'}; panflute {panflute_version}"
+
+    def key_for(self, content: str) -> str:
+        fingerprint = "\0".join([
+            self.tool_versions(), LatexConverter.INPUT_FORMAT, LatexConverter.OUTPUT_FORMAT, content])
+        return hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        try:
+            return (self.cache_folder / f"{key}.tex").read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def put(self, key: str, latex_content: str) -> None:
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            with tempfile.NamedTemporaryFile(
+                    "w", encoding="utf-8", dir=self.cache_folder, suffix=".tmp", delete=False) as temp_file:
+                temp_file.write(latex_content)
+            os.replace(temp_file.name, self.cache_folder / f"{key}.tex")
+        except OSError as e:
+            logger.warning(f"No se pudo guardar en caché LaTeX: {e}")
+
+
+class MarkdownLatexConverter:
+    LINE_WIDTH = 72
+    HEADING_COMMANDS = {1: "section", 2: "subsection", 3: "subsubsection"}
+    HEADING_PATTERN = re.compile(r"(#{1,6})[ ]+(.*?)[ ]*")
+    RAW_BLOCK_PATTERN = re.compile(r"\\newpage|\\vspace\{[0-9.]+(?:pt|em|ex|cm|mm|in)\}")
+    BLOCK_MARKER_PATTERN = re.compile(r"[-+*](?:[ ]|$)|[>|:~=<`%(\[\\#]|\d+[.)]|[A-Za-z]{1,4}[.)](?:[ ]|$)|[ ]{4}")
+    UNSUPPORTED_PATTERN = re.compile(r"[`<>\[\]^~$@|\\\t\x00-\x08\u00ad]|[^\x00-\u024f…—–“”‘’]")
+    EMPHASIS_PATTERN = re.compile(
+        r"(?<![\w*])(\*\*|__)(?=\S)([^*_]*?\S)\1(?![\w*])|(?<![\w*])([*_])(?=\S)([^*_]*?\S)\3(?![\w*])")
+    QUOTE_PATTERN = re.compile(r'(?<![\w"])"(?=\S)([^"]*?\S)"(?![\w"])')
+    APOSTROPHE_PATTERN = re.compile(r"(?<=\w)'(?=\w)")
+    LONE_UNDERSCORE_PATTERN = re.compile(r"(?<!\w)_|_(?!\w)")
+    TEXT_REPLACEMENTS = {
+        "{": r"\{", "}": r"\}", "%": r"\%", "&": r"\&", "#": r"\#", "_": r"\_",
+        "...": r"\ldots{}", "…": r"\ldots{}", "—": "---", "–": "--",
+        "“": "``", "”": "''", "‘": "`", "’": "'", "\u00a0": "~"}
+    ESCAPE_PATTERN = re.compile(r"\.\.\.|[{}%&#_…—–“”‘’\u00a0]")
+    PLAIN_REPLACEMENTS = [
+        ('"', ""), ("...", "…"), ("---", "—"), ("--", "–")]
+    # Las abreviaturas de pandoc llevan un espacio duro detrás.
+    ABBREVIATIONS = (
+        "aet.", "aetat.", "al.", "Apr.", "Aug.", "bk.", "Bros.", "c.", "Capt.", "cf.", "ch.", "chap.", "chs.",
+        "Co.", "col.", "Corp.", "cp.", "d.", "Dec.", "Dr.", "e.g.", "ed.", "eds.", "esp.", "f.", "fasc.", "Feb.",
+        "ff.", "fig.", "fl.", "fol.", "fols.", "Fr.", "Gen.", "Gov.", "Hon.", "i.e.", "ill.", "Inc.", "incl.",
+        "Jan.", "Jr.", "Jul.", "Jun.", "Ltd.", "M.A.", "M.D.", "Mar.", "Mr.", "Mrs.", "Ms.", "n.", "n.b.", "nn.",
+        "No.", "Nov.", "Oct.", "p.", "Ph.D.", "pp.", "Pres.", "Prof.", "pt.", "q.v.", "Rep.", "Rev.", "s.v.",
+        "s.vv.", "saec.", "sec.", "Sen.", "Sep.", "Sept.", "Sgt.", "Sr.", "St.", "univ.", "viz.", "vol.", "vs.")
+    ABBREVIATION_PATTERN = re.compile(
+        r"(?<![^\W_])(?<!\.)(" + "|".join(map(re.escape, ABBREVIATIONS)) + r")[ ]+")
+
+    @staticmethod
+    def convert(content: str) -> Optional[str]:
+        blocks = []
+        used_identifiers = set()
+        for lines in MarkdownLatexConverter._split_blocks(content):
+            block = MarkdownLatexConverter._convert_block(lines, used_identifiers)
+            if block is None:
+                return None
+            blocks.extend(block)
+        return "\n\n".join(blocks)
+
+    @staticmethod
+    def _split_blocks(content: str) -> Iterator[List[str]]:
+        block = []
+        for line in content.split("\n"):
+            if line.strip():
+                block.append(line)
+            elif block:
+                yield block
+                block = []
+        if block:
+            yield block
+
+    @staticmethod
+    def _convert_block(lines: List[str], used_identifiers: set) -> Optional[List[str]]:
+        converted = []
+        paragraph = []
+        for line in lines:
+            stripped = line.strip()
+            if len(line) - len(line.lstrip(" ")) > 3 or line.endswith("  "):
+                return None
+            if MarkdownLatexConverter.RAW_BLOCK_PATTERN.fullmatch(stripped) and len(lines) == 1:
+                converted.append(stripped)
+                continue
+            heading = MarkdownLatexConverter.HEADING_PATTERN.fullmatch(stripped)
+            if heading and not paragraph and not converted:
+                latex = MarkdownLatexConverter._convert_heading(heading, used_identifiers)
+                if latex is None:
+                    return None
+                converted.append(latex)
+                continue
+            if converted or MarkdownLatexConverter.BLOCK_MARKER_PATTERN.match(stripped) \
+                    or set(stripped) <= set("-*_ "):
+                return None
+            paragraph.append(line.lstrip(" "))
+
+        if paragraph:
+            text = MarkdownLatexConverter._convert_inline("\n".join(paragraph))
+            if text is None:
+                return None
+            converted.append(MarkdownLatexConverter._wrap(text))
+        return converted
+
+    @staticmethod
+    def _convert_heading(heading: Any, used_identifiers: set) -> Optional[str]:
+        level, title = len(heading.group(1)), heading.group(2)
+        if level not in MarkdownLatexConverter.HEADING_COMMANDS or title.endswith("#") \
+                or "--" in title or "..." in title or not title or "{" in title or "}" in title \
+                or MarkdownLatexConverter.EMPHASIS_PATTERN.search(title):
+            return None
+        text = MarkdownLatexConverter._convert_inline(title)
+        if text is None:
+            return None
+
+        identifier = MarkdownLatexConverter._identifier(title)
+        unique = identifier
+        suffix = 0
+        while unique in used_identifiers:
+            suffix += 1
+            unique = f"{identifier}-{suffix}"
+        used_identifiers.add(unique)
+        label = "".join(
+            character if (character.isascii() and character.isalnum()) or character in "_-+=:;."
+            else f"ux{ord(character):x}" for character in unique)
+        command = MarkdownLatexConverter.HEADING_COMMANDS[level]
+        return MarkdownLatexConverter._wrap(f"\\{command}{{{text}}}\\label{{{label}}}")
+
+    @staticmethod
+    def _identifier(title: str) -> str:
+        plain = MarkdownLatexConverter.EMPHASIS_PATTERN.sub(lambda match: match.group(2) or match.group(4), title)
+        for source, replacement in MarkdownLatexConverter.PLAIN_REPLACEMENTS:
+            plain = plain.replace(source, replacement)
+        allowed = "".join(character for character in plain.lower() if character.isalnum() or character in "_-. ")
+        identifier = "-".join(allowed.split())
+        while identifier and not identifier[0].isalpha():
+            identifier = identifier[1:]
+        return identifier or "section"
+
+    @staticmethod
+    def _convert_inline(text: str) -> Optional[str]:
+        if MarkdownLatexConverter.UNSUPPORTED_PATTERN.search(text):
+            return None
+        text = MarkdownLatexConverter.APOSTROPHE_PATTERN.sub("’", text)
+        text = MarkdownLatexConverter.QUOTE_PATTERN.sub("“\\1”", text)
+        if "'" in text or '"' in text:
+            return None
+
+        text = MarkdownLatexConverter.EMPHASIS_PATTERN.sub(
+            lambda match: f"\x02{match.group(2)}\x03" if match.group(1) else f"\x01{match.group(4)}\x03", text)
+        if "*" in text or MarkdownLatexConverter.LONE_UNDERSCORE_PATTERN.search(text):
+            return None
+        text = MarkdownLatexConverter.ABBREVIATION_PATTERN.sub("\\1\u00a0", text)
+        text = MarkdownLatexConverter.ESCAPE_PATTERN.sub(
+            lambda match: MarkdownLatexConverter.TEXT_REPLACEMENTS[match.group()], text)
+        return text.replace("\x01", "\\emph{").replace("\x02", "\\textbf{").replace("\x03", "}")
+
+    @staticmethod
+    def _wrap(text: str) -> str:
+        lines = []
+        current = ""
+        for word in text.split():
+            if current and len(current) + 1 + len(word) > MarkdownLatexConverter.LINE_WIDTH:
+                lines.append(current)
+                current = word
+            else:
+                current = f"{current} {word}" if current else word
+        lines.append(current)
+        return "\n".join(lines)
 
 
 class LatexConverter:
+    INPUT_FORMAT = "markdown"
+    OUTPUT_FORMAT = "latex"
+    LABEL_PATTERN = re.compile(r"\\(hypertarget|label)\{([^}]*)\}")
+    # Notas y enlaces por referencia pueden definirse en otro capítulo: entonces se convierte todo junto.
+    REFERENCE_DEFINITION_PATTERN = re.compile(r"^ {0,3}\[[^\]\n]+\]:", re.MULTILINE)
+
     @staticmethod
     def convert_to_latex(content: str) -> str:
         try:
-            latex_content = pf.convert_text(content, input_format="markdown", output_format="latex")
+            latex_content = LatexConverter._convert_natively(content)
+            if latex_content is None:
+                latex_content = LatexConverter._run_pandoc(content)
             logger.info("Conversión a LaTeX exitosa")
             return latex_content
         except Exception as e:
             error_msg = f"Error convirtiendo a LaTeX: {e}"
             logger.error(error_msg)
             raise CapituladorError(error_msg)
-    
+
+    @staticmethod
+    def convert_chapters(content: str, cache: Optional[LatexCache] = None, workers: Optional[int] = None) -> str:
+        workers = workers or settings.CONVERSION_WORKERS or os.cpu_count() or 1
+        chunks = LatexConverter.split_chapters(content)
+        parts = [LatexConverter._convert_natively(chunk) for chunk in chunks]
+        native_count = sum(part is not None for part in parts)
+        converted = {}
+
+        if native_count < len(chunks):
+            cache = cache or LatexCache()
+            keys = {index: cache.key_for(chunks[index]) for index, part in enumerate(parts) if part is None}
+            parts = [cache.get(keys[index]) if index in keys else part for index, part in enumerate(parts)]
+            pending = {keys[index]: chunks[index] for index in keys if parts[index] is None}
+
+            try:
+                if workers > 1 and len(pending) > 1:
+                    with ThreadPoolExecutor(max_workers=min(workers, len(pending))) as executor:
+                        converted = dict(zip(pending, executor.map(LatexConverter._run_pandoc, pending.values())))
+                else:
+                    converted = {key: LatexConverter._run_pandoc(chunk) for key, chunk in pending.items()}
+            except Exception as e:
+                error_msg = f"Error convirtiendo a LaTeX: {e}"
+                logger.error(error_msg)
+                raise CapituladorError(error_msg)
+
+            for key, latex_content in converted.items():
+                cache.put(key, latex_content)
+            parts = [converted[keys[index]] if part is None else part for index, part in enumerate(parts)]
+
+        logger.info(
+            f"Conversión a LaTeX exitosa ({native_count} nativos, {len(converted)} con pandoc, "
+            f"{len(chunks)} fragmentos)")
+        return LatexConverter._deduplicate_labels("\n\n".join(part for part in parts if part))
+
+    @staticmethod
+    def convert_stream(lines: Iterable[str], latex_file: str) -> None:
+        try:
+            with FileHandler.atomic_writer(latex_file, "w+b") as output, tempfile.TemporaryFile() as errors:
+                output.write(settings.LATEX_BEGIN.encode("utf-8"))
+                output.flush()
+                process = subprocess.Popen(
+                    ["pandoc", f"--from={LatexConverter.INPUT_FORMAT}", f"--to={LatexConverter.OUTPUT_FORMAT}"],
+                    stdin=subprocess.PIPE, stdout=output, stderr=errors, text=True, encoding="utf-8")
+                try:
+                    for position, line in enumerate(lines):
+                        process.stdin.write(line if position == 0 else f"\n{line}")
+                    process.stdin.close()
+                except BaseException:
+                    process.kill()
+                    raise
+                finally:
+                    process.wait()
+                if process.returncode != 0:
+                    errors.seek(0)
+                    raise CapituladorError(errors.read().decode("utf-8", "replace").strip() or "pandoc falló")
+                output.seek(-1, os.SEEK_END)
+                if output.read(1) == b"\n":
+                    output.seek(-1, os.SEEK_END)
+                    output.truncate()
+                output.write(settings.LATEX_END.encode("utf-8"))
+            logger.info("Conversión a LaTeX exitosa")
+        except FileNotFoundError:
+            error_msg = "pandoc no encontrado. Instala Pandoc."
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+        except Exception as e:
+            error_msg = f"Error convirtiendo a LaTeX: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+    @staticmethod
+    def split_chapters(content: str) -> List[str]:
+        if LatexConverter.REFERENCE_DEFINITION_PATTERN.search(content):
+            return [content]
+        return ManuscriptIndex(content).chapter_texts() or [content]
+
+    @staticmethod
+    def _convert_natively(content: str) -> Optional[str]:
+        if not settings.LATEX_NATIVE_CONVERTER:
+            return None
+        return MarkdownLatexConverter.convert(content)
+
+    @staticmethod
+    def _run_pandoc(content: str) -> str:
+        import panflute as pf
+
+        return pf.convert_text(
+            content, input_format=LatexConverter.INPUT_FORMAT, output_format=LatexConverter.OUTPUT_FORMAT)
+
+    @staticmethod
+    def _deduplicate_labels(latex_content: str) -> str:
+        # Cada capítulo se convierte por separado, así que pandoc no ve los
+        # identificadores de los demás: se repite aquí su numeración (id, id-1, ...).
+        used = set()
+        pending = {}
+
+        def unique(identifier: str) -> str:
+            candidate = identifier
+            suffix = 0
+            while candidate in used:
+                suffix += 1
+                candidate = f"{identifier}-{suffix}"
+            used.add(candidate)
+            return candidate
+
+        def replace(match: re.Match) -> str:
+            command, identifier = match.groups()
+            if command == "hypertarget":
+                pending[identifier] = unique(identifier)
+                new_identifier = pending[identifier]
+            elif identifier in pending:
+                new_identifier = pending.pop(identifier)
+            else:
+                new_identifier = unique(identifier)
+            return f"\\{command}{{{new_identifier}}}"
+
+        return LatexConverter.LABEL_PATTERN.sub(replace, latex_content)
+
     @staticmethod
     def create_complete_latex_document(content: str) -> str:
         return f"{settings.LATEX_BEGIN}{content}{settings.LATEX_END}"
 
 
+class LatexFormatCache:
+    FAILURE_RETRY_SECONDS = 3600
+    STALE_FORMAT_SECONDS = 7 * 24 * 3600
+    _build_lock = threading.Lock()
+
+    def __init__(self, cache_folder: Optional[str] = None):
+        self.cache_folder = Path(cache_folder or settings.CACHE_FOLDER) / "formats"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def engine_version() -> str:
+        return ToolVersions.version("pdflatex")
+
+    def format_name(self) -> str:
+        fingerprint = f"{self.engine_version()}\0{settings.LATEX_BEGIN}"
+        return f"preamble-{hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]}"
+
+    def get_format(self) -> Optional[str]:
+        if not self.engine_version():
+            return None
+        name = self.format_name()
+        if self._touch(self.cache_folder / f"{name}.fmt"):
+            return name
+        if self._failed_recently(name):
+            return None
+        with LatexFormatCache._build_lock:
+            if self._touch(self.cache_folder / f"{name}.fmt"):
+                return name
+            return self._build_format(name)
+
+    def _failed_recently(self, name: str) -> bool:
+        try:
+            failed_at = (self.cache_folder / f"{name}.failed").stat().st_mtime
+        except OSError:
+            return False
+        return time.time() - failed_at < self.FAILURE_RETRY_SECONDS
+
+    @staticmethod
+    def _touch(path: Path) -> bool:
+        # La fecha marca los formatos en uso para que otros procesos no los borren.
+        try:
+            os.utime(path)
+            return True
+        except OSError:
+            return False
+
+    def invalidate(self, name: str) -> None:
+        (self.cache_folder / f"{name}.fmt").unlink(missing_ok=True)
+        (self.cache_folder / f"{name}.failed").touch()
+
+    def environment(self) -> Dict[str, str]:
+        environment = dict(os.environ)
+        environment["TEXFORMATS"] = f"{self.cache_folder.resolve()}{os.pathsep}{environment.get('TEXFORMATS', '')}"
+        return environment
+
+    def _build_format(self, name: str) -> Optional[str]:
+        # Se compila con un nombre propio y se renombra: otro proceso puede estar usando el formato.
+        job_name = f"{name}-{os.getpid()}-{threading.get_ident()}"
+        try:
+            self.cache_folder.mkdir(parents=True, exist_ok=True)
+            self._remove_stale_formats(name)
+            preamble_file = self.cache_folder / f"{job_name}.tex"
+            preamble_file.write_text(f"{settings.LATEX_BEGIN}{settings.LATEX_END}", encoding="utf-8")
+            ProcessTree.run(
+                ["pdflatex", "-ini", "-interaction=nonstopmode", f"-jobname={job_name}",
+                 "&pdflatex", "mylatexformat.ltx", preamble_file.name],
+                cwd=self.cache_folder, check=True, capture_output=True, text=True)
+            os.replace(self.cache_folder / f"{job_name}.fmt", self.cache_folder / f"{name}.fmt")
+            (self.cache_folder / f"{name}.failed").unlink(missing_ok=True)
+            logger.info(f"Formato LaTeX precompilado: {name}")
+            return name
+        except (OSError, subprocess.CalledProcessError) as e:
+            logger.warning(f"No se pudo precompilar el preámbulo LaTeX, se usará el normal: {e}")
+            (self.cache_folder / f"{name}.failed").touch()
+            return None
+        finally:
+            for temp_file in self.cache_folder.glob(f"{job_name}.*"):
+                temp_file.unlink(missing_ok=True)
+
+    def _remove_stale_formats(self, name: str) -> None:
+        now = time.time()
+        for old_file in self.cache_folder.glob("preamble-*"):
+            try:
+                if not old_file.name.startswith(name) \
+                        and now - old_file.stat().st_mtime > self.STALE_FORMAT_SECONDS:
+                    old_file.unlink()
+            except OSError:
+                pass
+
+
 class PDFGenerator:
+    AUXILIARY_EXTENSIONS = (".aux", ".out", ".toc")
+
     @staticmethod
-    def generate_pdf() -> None:
-        output_directory = "generated"
+    def generate_pdf(latex_file: Optional[str] = None, output_directory: Optional[str] = None) -> None:
+        latex_file = latex_file or settings.LATEX_FILE
+        output_directory = output_directory or settings.OUTPUT_FOLDER
         try:
-            subprocess.run(
-                ["pdflatex", "-output-directory", output_directory, settings.LATEX_FILE],
-                check=True, capture_output=True, text=True)
-            logger.info("PDF generado")
+            format_name = PDFGenerator._cached_format(latex_file)
+            auxiliary_files = [
+                Path(output_directory) / f"{Path(latex_file).stem}{extension}"
+                for extension in PDFGenerator.AUXILIARY_EXTENSIONS]
+            stash_folder = PDFGenerator._stash_folder(latex_file)
+            PDFGenerator._restore_auxiliary_files(auxiliary_files, stash_folder)
+
+            (Path(output_directory) / f"{Path(latex_file).stem}.pdf").unlink(missing_ok=True)
+            previous_state = PDFGenerator._hash_files(auxiliary_files)
+            for pass_number in range(1, max(settings.LATEX_MAX_PASSES, 1) + 1):
+                format_name = PDFGenerator._run_pdflatex(latex_file, output_directory, format_name)
+                current_state = PDFGenerator._hash_files(auxiliary_files)
+                if current_state == previous_state:
+                    break
+                previous_state = current_state
+            else:
+                logger.warning(f"Las referencias no se estabilizaron tras {pass_number} pasadas de pdflatex")
+
+            PDFGenerator._stash_auxiliary_files(auxiliary_files, stash_folder)
+            logger.info(f"PDF generado ({pass_number} pasada{'s' if pass_number > 1 else ''})")
         except subprocess.CalledProcessError as e:
             error_msg = f"Error ejecutando pdflatex: {e}"
             logger.error(error_msg)
@@ -133,82 +867,348 @@ class PDFGenerator:
             logger.error(error_msg)
             raise CapituladorError(error_msg)
 
+    @staticmethod
+    def _run_pdflatex(latex_file: str, output_directory: str, format_name: Optional[str]) -> Optional[str]:
+        command = ["pdflatex", "-output-directory", output_directory, latex_file]
+        if format_name is not None:
+            format_cache = LatexFormatCache()
+            try:
+                ProcessTree.run(
+                    ["pdflatex", f"-fmt={format_name}", "-output-directory", output_directory, latex_file],
+                    check=True, capture_output=True, text=True, env=format_cache.environment())
+                return format_name
+            except subprocess.CalledProcessError as e:
+                logger.warning(f"Fallo con el preámbulo precompilado, se reintenta sin él: {e}")
+            # Si también falla sin el formato, el error está en el texto y el formato sigue siendo válido.
+            ProcessTree.run(command, check=True, capture_output=True, text=True)
+            format_cache.invalidate(format_name)
+            return None
+
+        ProcessTree.run(command, check=True, capture_output=True, text=True)
+        return None
+
+    @staticmethod
+    def _hash_files(file_paths: List[Path]) -> List[Optional[str]]:
+        hashes = []
+        for file_path in file_paths:
+            try:
+                hashes.append(hashlib.sha256(file_path.read_bytes()).hexdigest())
+            except OSError:
+                hashes.append(None)
+        return hashes
+
+    @staticmethod
+    def _stash_folder(latex_file: str) -> Path:
+        key = hashlib.sha256(str(Path(latex_file).resolve()).encode("utf-8")).hexdigest()[:16]
+        return Path(settings.CACHE_FOLDER) / "aux" / key
+
+    @staticmethod
+    def _restore_auxiliary_files(auxiliary_files: List[Path], stash_folder: Path) -> None:
+        for auxiliary_file in auxiliary_files:
+            stashed_file = stash_folder / auxiliary_file.name
+            if not auxiliary_file.exists() and stashed_file.exists():
+                shutil.copy2(stashed_file, auxiliary_file)
+
+    @staticmethod
+    def _stash_auxiliary_files(auxiliary_files: List[Path], stash_folder: Path) -> None:
+        try:
+            stash_folder.mkdir(parents=True, exist_ok=True)
+            for auxiliary_file in auxiliary_files:
+                if auxiliary_file.exists():
+                    shutil.copy2(auxiliary_file, stash_folder / auxiliary_file.name)
+        except OSError as e:
+            logger.warning(f"No se pudieron guardar los auxiliares de LaTeX: {e}")
+
+    @staticmethod
+    def _cached_format(latex_file: str) -> Optional[str]:
+        if not settings.LATEX_FORMAT_CACHE:
+            return None
+        try:
+            with open(latex_file, "r", encoding="utf-8") as file:
+                if file.read(len(settings.LATEX_BEGIN)) != settings.LATEX_BEGIN:
+                    return None
+        except OSError:
+            return None
+        return LatexFormatCache().get_format()
+
 
 class BackupManager:
+    CHUNK_SIZE = 1024 * 1024
+    INDEX_FILE = "index.jsonl"
+
     @staticmethod
-    def create_backup() -> str:
+    def create_backup(manuscript: Optional[Manuscript] = None) -> str:
         try:
-            FileHandler.ensure_directory_exists(settings.BACKUPS_FOLDER)
-            current_date = datetime.now().strftime("%Y-%m-%d")
-            backup_name = f"{current_date}_manuscript.txt"
-            backup_path = os.path.join(settings.BACKUPS_FOLDER, backup_name)
-            shutil.copy(settings.SOURCE_FILE, backup_path)
-            logger.info(f"Backup creado: {backup_name}")
-            return backup_name
+            if manuscript is None:
+                manuscript = Manuscript.load(settings.SOURCE_FILE)
+            backups = BackupManager.list_backups()
+            if backups and backups[-1]["hash"] == manuscript.hash:
+                logger.info(f"Backup sin cambios: {backups[-1]['name']}")
+                return backups[-1]["name"]
+
+            folder = Path(settings.BACKUPS_FOLDER)
+            version_file = folder / "versions" / f"{manuscript.hash}.json"
+            if not version_file.exists():
+                chunks = [BackupManager._store_chunk(chunk) for chunk in BackupManager._split(manuscript.data)]
+                FileHandler.ensure_directory_exists(str(version_file.parent))
+                FileHandler.write_if_changed(
+                    str(version_file), json.dumps({"size": len(manuscript.data), "chunks": chunks}))
+
+            timestamp = datetime.now().isoformat(timespec="seconds")
+            entry = {
+                "name": f"{timestamp}_{manuscript.hash[:12]}",
+                "timestamp": timestamp,
+                "hash": manuscript.hash,
+                "source": Path(manuscript.path or settings.SOURCE_FILE).name,
+            }
+            with open(folder / BackupManager.INDEX_FILE, "a", encoding="utf-8") as index_file:
+                index_file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            logger.info(f"Backup creado: {entry['name']}")
+            return entry["name"]
         except Exception as e:
             error_msg = f"Error creando backup: {e}"
             logger.error(error_msg)
             raise CapituladorError(error_msg)
 
+    @staticmethod
+    def list_backups() -> List[Dict[str, str]]:
+        try:
+            with open(Path(settings.BACKUPS_FOLDER) / BackupManager.INDEX_FILE, "r", encoding="utf-8") as index_file:
+                lines = index_file.readlines()
+        except FileNotFoundError:
+            return []
+
+        backups = []
+        for line in lines:
+            try:
+                backups.append(json.loads(line))
+            except ValueError:
+                logger.warning(f"Entrada de backup ilegible: {line.strip()}")
+        return backups
+
+    @staticmethod
+    def restore_backup(version: str, destination: Optional[str] = None) -> str:
+        try:
+            matches = [
+                backup for backup in BackupManager.list_backups()
+                if backup["timestamp"].startswith(version) or backup["hash"].startswith(version)
+                or backup["name"] == version]
+            if not matches:
+                raise CapituladorError(f"No hay ningún backup que coincida con '{version}'")
+            backup = matches[-1]
+
+            folder = Path(settings.BACKUPS_FOLDER)
+            with open(folder / "versions" / f"{backup['hash']}.json", "r", encoding="utf-8") as version_file:
+                chunks = json.load(version_file)["chunks"]
+            data = b"".join(
+                zlib.decompress((folder / "objects" / chunk[:2] / chunk[2:]).read_bytes()) for chunk in chunks)
+            if hashlib.sha256(data).hexdigest() != backup["hash"]:
+                raise CapituladorError(f"El backup {backup['name']} está dañado")
+
+            destination = destination or os.path.join(
+                settings.OUTPUT_FOLDER, "restored", f"{backup['name'].replace(':', '-')}_{backup['source']}")
+            Path(destination).parent.mkdir(parents=True, exist_ok=True)
+            FileHandler.write_if_changed(destination, data)
+            logger.info(f"Backup {backup['name']} restaurado en {destination}")
+            return destination
+        except CapituladorError:
+            raise
+        except Exception as e:
+            error_msg = f"Error restaurando backup: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+    @staticmethod
+    def _split(data: bytes) -> Iterator[bytes]:
+        # Se corta por capítulos para que los que no cambian se compartan entre versiones.
+        offsets = [offset for offset in ManuscriptIndex.byte_offsets(data) if offset]
+        for start, end in zip([0] + offsets, offsets + [len(data)]):
+            for position in range(start, end, BackupManager.CHUNK_SIZE):
+                yield data[position:min(position + BackupManager.CHUNK_SIZE, end)]
+
+    @staticmethod
+    def _store_chunk(chunk: bytes) -> str:
+        chunk_hash = hashlib.sha256(chunk).hexdigest()
+        chunk_file = Path(settings.BACKUPS_FOLDER) / "objects" / chunk_hash[:2] / chunk_hash[2:]
+        if not chunk_file.exists():
+            chunk_file.parent.mkdir(parents=True, exist_ok=True)
+            FileHandler.write_if_changed(str(chunk_file), zlib.compress(chunk, 9))
+        return chunk_hash
+
 
 class ChapterGenerator:
-    CHAPTER_PATTERN = re.compile(r"^# Chapter \d+")
-    
+    CHAPTER_FILE_PATTERN = re.compile(r"chapter(\d+)\.txt")
+
     @staticmethod
-    def generate_chapters() -> int:
+    def generate_chapters(manuscript: Optional[Manuscript] = None) -> int:
         try:
-            content = FileHandler.read_file(settings.SOURCE_FILE)
-            lines = content.splitlines(keepends=True)
-            FileHandler.ensure_directory_exists("generated/chapters")
-            
-            chapter_count = 0
-            current_chapter = None
-            chapter_text = []
-            
-            for line in lines:
-                if ChapterGenerator.CHAPTER_PATTERN.match(line):
-                    if current_chapter is not None:
-                        ChapterGenerator._write_chapter(chapter_count + 1, chapter_text)
-                        chapter_count += 1
-                        chapter_text = []
-                    current_chapter = line.strip()
-                chapter_text.append(line)
-            
-            if current_chapter is not None:
-                chapter_count += 1
-                ChapterGenerator._write_chapter(chapter_count, chapter_text)
-            
-            logger.info(f"{chapter_count} capítulos generados")
-            return chapter_count
+            manuscript = manuscript or Manuscript.load(settings.SOURCE_FILE)
+            if ChapterGenerator._splits_bytes(len(manuscript.data)) and manuscript.data.find(b"\r") < 0:
+                return ChapterGenerator.write_chapter_slices(settings.CHAPTERS_FOLDER, manuscript.data)
+            return ChapterGenerator.write_chapters(settings.CHAPTERS_FOLDER, manuscript.chapters())
         except Exception as e:
             error_msg = f"Error generando capítulos: {e}"
             logger.error(error_msg)
             raise CapituladorError(error_msg)
     
     @staticmethod
-    def _write_chapter(chapter_number: int, chapter_text: List[str]) -> None:
-        chapter_path = f"generated/chapters/chapter{chapter_number}.txt"
-        content = "".join(chapter_text)
-        FileHandler.write_file(chapter_path, content)
+    def write_chapter_slices(chapters_folder: str, data: Any) -> int:
+        offsets = ManuscriptIndex.byte_offsets(data)
+        ranges = list(zip([0] + offsets[1:], offsets[1:] + [len(data)])) if offsets else []
+        with memoryview(data) as view:
+            return ChapterGenerator.write_chapters(chapters_folder, (view[start:end] for start, end in ranges))
+    
+    @staticmethod
+    def write_chapters(chapters_folder: str, chapter_texts: Iterable[Any]) -> int:
+        FileHandler.ensure_directory_exists(chapters_folder)
+        chapter_count = written = 0
+        for chapter_count, chapter_text in enumerate(chapter_texts, 1):
+            chapter_path = os.path.join(chapters_folder, f"chapter{chapter_count}.txt")
+            written += FileHandler.write_if_changed(chapter_path, chapter_text)
+        
+        removed = 0
+        for chapter_file in Path(chapters_folder).iterdir():
+            match = ChapterGenerator.CHAPTER_FILE_PATTERN.fullmatch(chapter_file.name)
+            if match and int(match.group(1)) > chapter_count:
+                chapter_file.unlink()
+                removed += 1
+        
+        logger.info(
+            f"{chapter_count} capítulos generados ({written} escritos, {chapter_count - written} sin cambios, "
+            f"{removed} obsoletos eliminados)")
+        return chapter_count
+    
+    @staticmethod
+    def _splits_bytes(size: int) -> bool:
+        # Los capítulos se copian tal cual del archivo, así que solo se evita
+        # decodificar cuando el resultado sería idéntico al del texto.
+        return 0 < settings.MANUSCRIPT_MMAP_THRESHOLD <= size and os.linesep == "\n"
+
+
+class DraftBuilder:
+    def __init__(self, output_directory: Optional[str] = None):
+        self._output_directory = output_directory
+
+    @property
+    def output_directory(self) -> Path:
+        return Path(self._output_directory or os.path.join(settings.OUTPUT_FOLDER, "draft"))
+
+    @property
+    def state_file(self) -> Path:
+        return self.output_directory / "chapters.json"
+
+    def build(self, manuscript: Manuscript, chapters: Optional[List[int]] = None) -> List[int]:
+        try:
+            # Se numera por la cabecera "# Chapter N", como en el GUI; los números repetidos van juntos.
+            numbered: Dict[int, List[IndexedChapter]] = {}
+            for chapter in manuscript.index.chapters:
+                numbered.setdefault(chapter.number, []).append(chapter)
+            chapter_texts = {
+                number: "".join(manuscript.index.text[chapter.start:chapter.end] for chapter in group)
+                for number, group in numbered.items()}
+            chapter_hashes = {
+                number: ":".join(chapter.hash for chapter in group) for number, group in numbered.items()}
+            previous_hashes = self._load_state()
+
+            if chapters:
+                unknown = sorted(set(chapters) - set(chapter_texts))
+                if unknown:
+                    raise CapituladorError(f"Capítulos inexistentes: {', '.join(map(str, unknown))}")
+                selected = sorted(set(chapters))
+            else:
+                selected = sorted(number for number, chapter_hash in chapter_hashes.items()
+                                  if previous_hashes.get(str(number)) != chapter_hash)
+
+            if not selected:
+                logger.info("Ningún capítulo modificado desde el último borrador")
+                return []
+
+            FileHandler.ensure_directory_exists(str(self.output_directory))
+            includes = []
+            for number in selected:
+                processed_content = ContentProcessor.process_content(chapter_texts[number])
+                chapter_file = self.output_directory / f"chapter{number}.tex"
+                FileHandler.write_file(str(chapter_file), LatexConverter.convert_chapters(processed_content))
+                includes.append(f"\\clearpage\n\\input{{{chapter_file.as_posix()}}}")
+
+            draft_file = self.output_directory / "draft.tex"
+            FileHandler.write_file(
+                str(draft_file), LatexConverter.create_complete_latex_document("\n\n".join(includes)))
+            PDFGenerator.generate_pdf(str(draft_file), str(self.output_directory))
+
+            previous_hashes.update({str(number): chapter_hashes[number] for number in selected})
+            FileHandler.write_file(str(self.state_file), json.dumps(previous_hashes, indent=2))
+            logger.info(f"Borrador generado con los capítulos: {', '.join(map(str, selected))}")
+            return selected
+        except CapituladorError:
+            raise
+        except Exception as e:
+            error_msg = f"Error generando borrador: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+    def _load_state(self) -> Dict[str, str]:
+        try:
+            with open(self.state_file, "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return {}
 
 
 class EbookConverter:
     @staticmethod
-    def convert_to_ebook() -> None:
+    def convert_to_epub(content: str, epub_file: Optional[str] = None, book_settings: Any = None) -> None:
+        book = book_settings or settings
+        epub_file = epub_file or settings.EPUB_FILE
+        metadata = {
+            "title": book.TITLE,
+            "author": book.AUTHORS,
+            "lang": book.LANGUAGE,
+            "publisher": book.PUBLISHER,
+            "description": book.DESCRIPTION,
+            "identifier": book.IDENTIFIER,
+            "date": book.PUBDATE,
+            "subject": book.SUBJECT,
+        }
+        command = ["pandoc", "--from=markdown", "--to=epub3", f"--output={epub_file}", "--epub-chapter-level=1"]
+        command += [f"--metadata={key}:{value}" for key, value in metadata.items() if value]
+        if book.COVER and os.path.isfile(book.COVER):
+            command.append(f"--epub-cover-image={book.COVER}")
+
+        try:
+            Path(epub_file).parent.mkdir(parents=True, exist_ok=True)
+            Path(epub_file).unlink(missing_ok=True)
+            ProcessTree.run(command, input=content, check=True, capture_output=True, text=True, encoding="utf-8")
+            logger.info("Conversión a EPUB exitosa")
+        except subprocess.CalledProcessError as e:
+            error_msg = f"Error convirtiendo a EPUB: {e.stderr.strip() or e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+        except FileNotFoundError:
+            error_msg = "pandoc no encontrado. Instala Pandoc."
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+    @staticmethod
+    def convert_to_ebook(epub_file: Optional[str] = None, azw3_file: Optional[str] = None,
+                         book_settings: Any = None) -> None:
+        book = book_settings or settings
         metadata_args = [
-            f'--authors="{settings.AUTHORS}"',
-            f'--title="{settings.TITLE}"',
-            f'--language="{settings.LANGUAGE}"',
-            f'--publisher="{settings.PUBLISHER}"',
-            f'--comments="{settings.DESCRIPTION}"',
-            f'--pubdate="{settings.PUBDATE}"',
-            f'--tags="{settings.SUBJECT}"'
+            f"--authors={book.AUTHORS}",
+            f"--title={book.TITLE}",
+            f"--language={book.LANGUAGE}",
+            f"--publisher={book.PUBLISHER}",
+            f"--comments={book.DESCRIPTION}",
+            f"--pubdate={book.PUBDATE}",
+            f"--tags={book.SUBJECT}"
         ]
 
-        command = f"ebook-convert {settings.PDF_FILE} {settings.AZW3_FILE} {' '.join(metadata_args)}"
+        azw3_file = azw3_file or settings.AZW3_FILE
+        command = ["ebook-convert", epub_file or settings.EPUB_FILE, azw3_file] + metadata_args
 
         try:
-            subprocess.run(command, shell=True, check=True)
+            Path(azw3_file).unlink(missing_ok=True)
+            ProcessTree.run(command, check=True, capture_output=True, text=True)
             logger.info("Conversión a AZW3 exitosa")
         except subprocess.CalledProcessError as e:
             error_msg = f"Error convirtiendo a AZW3: {e}"
@@ -233,7 +1233,272 @@ class SystemCleaner:
             logger.info("Limpieza omitida (solo macOS)")
 
 
+class BuildCache:
+    STALE_TEMP_SECONDS = 3600
+
+    def __init__(self, cache_folder: Optional[str] = None):
+        self._cache_folder = cache_folder
+
+    @property
+    def cache_folder(self) -> Path:
+        return Path(self._cache_folder or settings.CACHE_FOLDER) / "builds"
+
+    @staticmethod
+    @lru_cache(maxsize=None)
+    def ebook_converter_version() -> str:
+        return ToolVersions.version("ebook-convert")
+
+    def fingerprint(self, manuscript: Manuscript, book_settings: Any = None, variant: str = "") -> str:
+        from config.config import BookSettings
+
+        book = book_settings or settings
+        metadata = {field: getattr(book, field) for field in BookSettings.model_fields}
+        parts = [
+            settings.PROGRAM_VERSION, variant, manuscript.hash, settings.LATEX_BEGIN, settings.LATEX_END,
+            json.dumps(metadata, sort_keys=True), LatexCache.tool_versions(),
+            LatexFormatCache.engine_version(), self.ebook_converter_version(),
+            str(settings.LATEX_NATIVE_CONVERTER), str(settings.LATEX_MAX_PASSES), str(settings.LATEX_FORMAT_CACHE)]
+        return hashlib.sha256("\0".join(parts).encode("utf-8")).hexdigest()
+
+    def restore(self, fingerprint: str, artifacts: Dict[str, str]) -> bool:
+        entry = self.cache_folder / fingerprint
+        if not all((entry / name).exists() for name in artifacts):
+            return False
+        try:
+            for name, destination in artifacts.items():
+                self._place(entry / name, Path(destination), settings.BUILD_CACHE_HARDLINKS)
+            os.utime(entry)
+            logger.info(f"Construcción recuperada de la caché: {fingerprint[:12]}")
+            return True
+        except OSError as e:
+            logger.warning(f"No se pudo recuperar la construcción de la caché: {e}")
+            return False
+
+    def store(self, fingerprint: str, artifacts: Dict[str, str]) -> None:
+        entry = self.cache_folder / fingerprint
+        temp_entry = self.cache_folder / f"{fingerprint}.{os.getpid()}.tmp"
+        try:
+            shutil.rmtree(temp_entry, ignore_errors=True)
+            temp_entry.mkdir(parents=True)
+            for name, source in artifacts.items():
+                self._place(Path(source), temp_entry / name, False)
+            shutil.rmtree(entry, ignore_errors=True)
+            os.replace(temp_entry, entry)
+            logger.info(f"Construcción guardada en caché: {fingerprint[:12]}")
+        except OSError as e:
+            logger.warning(f"No se pudo guardar la construcción en caché: {e}")
+        finally:
+            shutil.rmtree(temp_entry, ignore_errors=True)
+        self._evict()
+
+    @staticmethod
+    def detach(artifacts: Dict[str, str]) -> None:
+        # Los artefactos recuperados pueden ser enlaces duros a la caché; se
+        # eliminan antes de regenerarlos para no escribir dentro de la caché.
+        for destination in map(Path, artifacts.values()):
+            if destination.is_file():
+                destination.unlink()
+
+    @staticmethod
+    def _place(source: Path, destination: Path, hardlink: bool) -> None:
+        if source.is_dir():
+            BuildCache._sync_directory(source, destination)
+            return
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        destination.unlink(missing_ok=True)
+        if hardlink:
+            try:
+                os.link(source, destination)
+                return
+            except OSError:
+                pass
+        shutil.copy2(source, destination)
+
+    @staticmethod
+    def _sync_directory(source: Path, destination: Path) -> None:
+        if destination.is_file():
+            destination.unlink()
+        destination.mkdir(parents=True, exist_ok=True)
+        names = set()
+        for source_file in source.iterdir():
+            names.add(source_file.name)
+            if source_file.is_dir():
+                BuildCache._sync_directory(source_file, destination / source_file.name)
+            else:
+                FileHandler.write_if_changed(str(destination / source_file.name), source_file.read_bytes())
+        for stale in destination.iterdir():
+            if stale.name in names:
+                continue
+            if stale.is_dir():
+                shutil.rmtree(stale)
+            else:
+                stale.unlink()
+
+    def _evict(self) -> None:
+        self._remove_stale_temp_entries()
+        try:
+            entries = sorted(
+                (entry for entry in self.cache_folder.iterdir() if entry.is_dir() and "." not in entry.name),
+                key=lambda entry: entry.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+
+        max_bytes = settings.BUILD_CACHE_MAX_MB * 1024 * 1024
+        total_bytes = 0
+        for position, entry in enumerate(entries):
+            total_bytes += sum(file.stat().st_size for file in entry.rglob("*") if file.is_file())
+            if position >= settings.BUILD_CACHE_MAX_ENTRIES or total_bytes > max_bytes:
+                shutil.rmtree(entry, ignore_errors=True)
+                logger.info(f"Construcción eliminada de la caché: {entry.name[:12]}")
+
+    def _remove_stale_temp_entries(self) -> None:
+        # Restos de construcciones interrumpidas; las recientes pueden ser de otro proceso en marcha.
+        try:
+            for entry in self.cache_folder.glob("*.tmp"):
+                if time.time() - entry.stat().st_mtime > self.STALE_TEMP_SECONDS:
+                    shutil.rmtree(entry, ignore_errors=True)
+        except OSError:
+            pass
+
+
+class BuildStage:
+    def __init__(self, name: str, action: Callable[[], Any], dependencies: Iterable[str] = ()):
+        self.name = name
+        self.action = action
+        self.dependencies = tuple(dependencies)
+        self.result = None
+        self.error: Optional[BaseException] = None
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+
+    @property
+    def duration(self) -> float:
+        if self.started is None or self.finished is None:
+            return 0.0
+        return self.finished - self.started
+
+    def run(self) -> Any:
+        self.started = time.perf_counter()
+        try:
+            self.result = self.action()
+            return self.result
+        finally:
+            self.finished = time.perf_counter()
+
+
+class BuildScheduler:
+    def __init__(self, max_workers: Optional[int] = None, on_event: Optional[Callable[[str, str], None]] = None):
+        self.max_workers = max_workers
+        self.on_event = on_event
+        self.stages: Dict[str, BuildStage] = {}
+
+    def add_stage(self, name: str, action: Callable[[], Any], dependencies: Iterable[str] = ()) -> None:
+        if name in self.stages:
+            raise CapituladorError(f"Etapa duplicada: {name}")
+        self.stages[name] = BuildStage(name, action, dependencies)
+
+    def run(self) -> Dict[str, Any]:
+        order = self._topological_order()
+        pending = list(order)
+        completed = set()
+        failed = set()
+        running = {}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers or len(self.stages) or 1) as executor:
+            while pending or running:
+                for name in list(pending):
+                    stage = self.stages[name]
+                    if any(dependency in failed for dependency in stage.dependencies):
+                        logger.warning(f"Etapa omitida por fallo previo: {name}")
+                        failed.add(name)
+                        pending.remove(name)
+                        self._notify(name, "omitida")
+                    elif all(dependency in completed for dependency in stage.dependencies):
+                        running[executor.submit(copy_context().run, stage.run)] = stage
+                        pending.remove(name)
+                        self._notify(name, "iniciada")
+
+                if not running:
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    stage = running.pop(future)
+                    stage.error = future.exception()
+                    if stage.error is None:
+                        completed.add(stage.name)
+                        logger.info(f"Etapa completada: {stage.name} ({stage.duration:.2f}s)")
+                        self._notify(stage.name, "completada")
+                    else:
+                        failed.add(stage.name)
+                        logger.error(f"Etapa fallida: {stage.name}: {stage.error}")
+                        self._notify(stage.name, "fallida")
+
+        path = self.critical_path()
+        if path:
+            total = sum(self.stages[name].duration for name in path)
+            logger.info(f"Ruta crítica: {' -> '.join(path)} ({total:.2f}s)")
+
+        errors = [self.stages[name].error for name in order if self.stages[name].error is not None]
+        if errors:
+            if isinstance(errors[0], CapituladorError):
+                raise errors[0]
+            raise CapituladorError(f"Error en etapa de construcción: {errors[0]}") from errors[0]
+
+        return {name: stage.result for name, stage in self.stages.items()}
+
+    def critical_path(self) -> List[str]:
+        longest: Dict[str, float] = {}
+        previous: Dict[str, Optional[str]] = {}
+        for name in self._topological_order():
+            stage = self.stages[name]
+            if stage.finished is None:
+                continue
+            best = max((dependency for dependency in stage.dependencies if dependency in longest),
+                       key=longest.get, default=None)
+            longest[name] = stage.duration + (longest[best] if best else 0.0)
+            previous[name] = best
+
+        if not longest:
+            return []
+        name = max(longest, key=longest.get)
+        path = []
+        while name is not None:
+            path.append(name)
+            name = previous[name]
+        return path[::-1]
+
+    def _notify(self, name: str, status: str) -> None:
+        if self.on_event is not None:
+            self.on_event(name, status)
+
+    def _topological_order(self) -> List[str]:
+        order = []
+        visiting = set()
+        visited = set()
+
+        def visit(name: str) -> None:
+            if name in visited:
+                return
+            if name in visiting:
+                raise CapituladorError(f"Dependencia circular en la etapa: {name}")
+            if name not in self.stages:
+                raise CapituladorError(f"Etapa desconocida: {name}")
+            visiting.add(name)
+            for dependency in self.stages[name].dependencies:
+                visit(dependency)
+            visiting.remove(name)
+            visited.add(name)
+            order.append(name)
+
+        for name in self.stages:
+            visit(name)
+        return order
+
+
 class Capitulador:
+    BUILD_FORMATS = ("pdf", "ebook", "chapters")
+
     def __init__(self):
         self.file_handler = FileHandler()
         self.content_processor = ContentProcessor()
@@ -243,28 +1508,69 @@ class Capitulador:
         self.chapter_generator = ChapterGenerator()
         self.ebook_converter = EbookConverter()
         self.system_cleaner = SystemCleaner()
+        self.draft_builder = DraftBuilder()
+        self.build_cache = BuildCache()
     
-    def process_manuscript(self) -> None:
+    def process_manuscript(self, manuscript: Optional[Manuscript] = None, formats: Optional[Iterable[str]] = None,
+                           progress: Optional[Callable[[str, str], None]] = None) -> Dict[str, str]:
+        owned_manuscript = manuscript is None
         try:
             logger.info("Iniciando procesamiento")
             
-            content = self.file_handler.read_file(settings.SOURCE_FILE)
-            processed_content = self.content_processor.process_content(content)
-            self.file_handler.write_file(settings.WORK_FILE, processed_content)
+            formats = sorted(set(formats or self.BUILD_FORMATS))
+            unknown = set(formats) - set(self.BUILD_FORMATS)
+            if unknown:
+                raise CapituladorError(f"Formatos desconocidos: {', '.join(sorted(unknown))}")
             
-            latex_content = self.latex_converter.convert_to_latex(processed_content)
-            complete_latex = self.latex_converter.create_complete_latex_document(latex_content)
-            self.file_handler.write_file(settings.LATEX_FILE, complete_latex)
+            manuscript = manuscript or Manuscript.load(settings.SOURCE_FILE)
+            artifacts = {"work.md": settings.WORK_FILE}
+            if "pdf" in formats:
+                artifacts.update({"book.tex": settings.LATEX_FILE, "book.pdf": settings.PDF_FILE})
+            if "ebook" in formats:
+                artifacts.update({"book.epub": settings.EPUB_FILE, "book.azw3": settings.AZW3_FILE})
+            if "chapters" in formats:
+                artifacts["chapters"] = settings.CHAPTERS_FOLDER
             
-            self.pdf_generator.generate_pdf()
-            backup_name = self.backup_manager.create_backup()
-            chapter_count = self.chapter_generator.generate_chapters()
-            self.ebook_converter.convert_to_ebook()
-            self.system_cleaner.clean_dot_files()
+            fingerprint = self.build_cache.fingerprint(manuscript, variant=",".join(formats))
+            if self.build_cache.restore(fingerprint, artifacts):
+                backup_name = self.backup_manager.create_backup(manuscript)
+                self.system_cleaner.clean_dot_files()
+                logger.info(f"Procesamiento completado (sin cambios)")
+                logger.info(f"Backup: {backup_name}")
+                return artifacts
+            
+            self.build_cache.detach(artifacts)
+            # Solo LaTeX y EPUB necesitan el texto completo; el resto trabaja por líneas o sobre los bytes.
+            processed = []
+            processed_lock = threading.Lock()
+            
+            def processed_content() -> str:
+                with processed_lock:
+                    if not processed:
+                        processed.append(self.content_processor.process_content(manuscript.text))
+                    return processed[0]
+            
+            scheduler = BuildScheduler(on_event=progress)
+            scheduler.add_stage("work_file", lambda: self.file_handler.write_lines(
+                settings.WORK_FILE, self.content_processor.iter_processed_lines(manuscript.iter_lines())))
+            scheduler.add_stage("backup", lambda: self.backup_manager.create_backup(manuscript))
+            if "pdf" in formats:
+                scheduler.add_stage("latex", lambda: self._write_latex(processed_content()))
+                scheduler.add_stage("pdf", self.pdf_generator.generate_pdf, ["latex"])
+            if "chapters" in formats:
+                scheduler.add_stage("chapters", lambda: self.chapter_generator.generate_chapters(manuscript))
+            if "ebook" in formats:
+                scheduler.add_stage("epub", lambda: self.ebook_converter.convert_to_epub(processed_content()))
+                scheduler.add_stage("ebook", self.ebook_converter.convert_to_ebook, ["epub"])
+            scheduler.add_stage("clean", self.system_cleaner.clean_dot_files, list(scheduler.stages))
+            results = scheduler.run()
+            self.build_cache.store(fingerprint, artifacts)
             
             logger.info(f"Procesamiento completado")
-            logger.info(f"Backup: {backup_name}")
-            logger.info(f"Capítulos: {chapter_count}")
+            logger.info(f"Backup: {results['backup']}")
+            if "chapters" in formats:
+                logger.info(f"Capítulos: {results['chapters']}")
+            return artifacts
             
         except CapituladorError as e:
             logger.error(f"Error durante procesamiento: {e}")
@@ -272,12 +1578,580 @@ class Capitulador:
         except Exception as e:
             logger.error(f"Error inesperado: {e}")
             raise CapituladorError(f"Error inesperado: {e}")
+        finally:
+            if owned_manuscript and manuscript is not None:
+                manuscript.close()
+
+    def process_streaming(self) -> None:
+        try:
+            logger.info("Iniciando procesamiento en flujo")
+            with open(settings.SOURCE_FILE, "r", encoding="utf-8") as source, \
+                    FileHandler.atomic_writer(settings.WORK_FILE) as work_file:
+                processed_lines = self.content_processor.iter_processed_lines(source)
+                self.latex_converter.convert_stream(
+                    self.content_processor.tee_lines(processed_lines, work_file), settings.LATEX_FILE)
+            self.pdf_generator.generate_pdf()
+            logger.info("Procesamiento completado")
+        except CapituladorError as e:
+            logger.error(f"Error durante procesamiento: {e}")
+            raise
+        except Exception as e:
+            logger.error(f"Error inesperado: {e}")
+            raise CapituladorError(f"Error inesperado: {e}")
+
+    def build_draft(self, chapters: Optional[List[int]] = None) -> List[int]:
+        try:
+            logger.info("Iniciando borrador")
+            manuscript = Manuscript.load(settings.SOURCE_FILE)
+            return self.draft_builder.build(manuscript, chapters)
+        except CapituladorError as e:
+            logger.error(f"Error durante borrador: {e}")
+            raise
+
+    def _write_latex(self, processed_content: str) -> None:
+        latex_content = self.latex_converter.convert_chapters(processed_content)
+        complete_latex = self.latex_converter.create_complete_latex_document(latex_content)
+        self.file_handler.write_file(settings.LATEX_FILE, complete_latex)
+
+
+class BatchBuilder:
+    def __init__(self, manifest_file: str, workers: Optional[int] = None):
+        self.manifest_file = Path(manifest_file)
+        self.workers = workers or settings.BATCH_WORKERS
+        self.capitulador = Capitulador()
+
+    def load_manifest(self) -> List[Dict[str, Any]]:
+        try:
+            data = json.loads(self.manifest_file.read_text(encoding="utf-8"))
+        except (OSError, json.JSONDecodeError) as e:
+            raise CapituladorError(f"No se pudo leer el manifiesto {self.manifest_file}: {e}")
+
+        base_folder = self.manifest_file.parent
+        books = []
+        for entry in data["books"] if isinstance(data, dict) else data:
+            if "source" not in entry:
+                raise CapituladorError(f"Entrada del manifiesto sin 'source': {entry}")
+            source = base_folder / entry["source"]
+            name = entry.get("name", source.stem)
+            output = base_folder / entry["output"] if "output" in entry else Path(settings.OUTPUT_FOLDER) / name
+            books.append({
+                "name": name,
+                "source": str(source),
+                "env": str(base_folder / entry["env"]) if "env" in entry else None,
+                "output": str(output),
+                "formats": entry.get("formats"),
+                "settings": {"BACKUPS_FOLDER": str(output / "backups"), **entry.get("settings", {})},
+            })
+
+        outputs = [Path(book["output"]).resolve() for book in books]
+        if len(set(outputs)) != len(outputs):
+            raise CapituladorError("Varios libros del manifiesto comparten carpeta de salida")
+        return books
+
+    def run(self) -> List[Dict[str, Any]]:
+        books = self.load_manifest()
+        logger.info(f"Construyendo {len(books)} libros con {self.workers} trabajadores")
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            results = list(executor.map(self.build_book, books))
+
+        for result in results:
+            if result["error"] is None:
+                logger.info(f"  ✓ {result['name']}: {result['duration']:.2f}s -> {result['output']}")
+            else:
+                logger.error(f"  ✗ {result['name']}: {result['duration']:.2f}s -> {result['error']}")
+        failures = sum(1 for result in results if result["error"] is not None)
+        logger.info(f"Lote completado: {len(results) - failures} correctos, {failures} fallidos")
+        return results
+
+    def build_book(self, book: Dict[str, Any]) -> Dict[str, Any]:
+        start = time.perf_counter()
+        result = {"name": book["name"], "output": book["output"], "artifacts": {}, "error": None}
+        try:
+            overrides = {**book["settings"], "SOURCE_FILE": book["source"], "OUTPUT_FOLDER": book["output"]}
+            with settings_provider.override(env_file=book["env"], **overrides):
+                result["artifacts"] = self.capitulador.process_manuscript(formats=book["formats"])
+        except Exception as e:
+            logger.error(f"Error construyendo {book['name']}: {e}")
+            result["error"] = str(e)
+        result["duration"] = time.perf_counter() - start
+        return result
+
+
+class BuildServer:
+    TCP_ADDRESS_PATTERN = re.compile(r"^[\w.\-]+:\d+$")
+
+    def __init__(self, address: Optional[str] = None, max_jobs: Optional[int] = None):
+        self.address = address or settings.SERVER_ADDRESS
+        self.jobs = threading.BoundedSemaphore(max_jobs or settings.SERVER_MAX_JOBS)
+        self.capitulador = Capitulador()
+
+    def serve_forever(self) -> None:
+        server = self._create_server()
+        logger.info(f"Servidor escuchando en {self.address}")
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            if not self.TCP_ADDRESS_PATTERN.match(self.address):
+                Path(self.address).unlink(missing_ok=True)
+
+    def handle_job(self, reader: Any, writer: Any) -> None:
+        def send(event: str, **data: Any) -> None:
+            writer.write((json.dumps({"event": event, **data}, ensure_ascii=False) + "\n").encode("utf-8"))
+            writer.flush()
+
+        def progress(stage: str, status: str) -> None:
+            if not cancellation.cancelled:
+                send("stage", stage=stage, status=status)
+
+        cancellation = CancellationToken()
+        finished = threading.Event()
+        try:
+            request = reader.readline()
+            if not request.strip():
+                # BuildClient.is_available conecta y cierra sin enviar nada.
+                return
+            job = json.loads(request)
+            threading.Thread(target=self._watch_client, args=(reader, cancellation, finished), daemon=True).start()
+            send("queued")
+            with self.jobs:
+                cancellation.check()
+                send("started")
+                with cancellation.activate():
+                    artifacts = self.run_job(job, progress)
+            send("done", artifacts=artifacts)
+        except Exception as e:
+            if cancellation.cancelled:
+                logger.info("Trabajo del servidor cancelado por el cliente")
+                return
+            logger.error(f"Error en trabajo del servidor: {e}")
+            try:
+                send("error", message=str(e))
+            except OSError:
+                pass
+        finally:
+            finished.set()
+
+    @staticmethod
+    def _watch_client(reader: Any, cancellation: "CancellationToken", finished: threading.Event) -> None:
+        # El cliente no envía nada más tras el trabajo: si cierra la conexión antes de tiempo, lo cancela.
+        try:
+            reader.read()
+        except (OSError, ValueError):
+            pass
+        if not finished.is_set():
+            cancellation.cancel()
+
+    def run_job(self, job: Dict[str, Any], progress: Callable[[str, str], None]) -> Dict[str, str]:
+        overrides = {}
+        if job.get("source"):
+            overrides["SOURCE_FILE"] = job["source"]
+        if job.get("output"):
+            overrides["OUTPUT_FOLDER"] = job["output"]
+        with settings_provider.override(**overrides):
+            manuscript = Manuscript.from_text(job["content"]) if "content" in job else None
+            artifacts = self.capitulador.process_manuscript(manuscript, job.get("formats"), progress)
+            return {name: str(Path(path).resolve()) for name, path in artifacts.items()}
+
+    def _create_server(self) -> socketserver.BaseServer:
+        build_server = self
+
+        class JobHandler(socketserver.StreamRequestHandler):
+            def handle(self) -> None:
+                build_server.handle_job(self.rfile, self.wfile)
+
+        if self.TCP_ADDRESS_PATTERN.match(self.address) or not hasattr(socket, "AF_UNIX"):
+            host, port = self.address.rsplit(":", 1)
+            self._check_loopback(host)
+            return socketserver.ThreadingTCPServer((host, int(port)), JobHandler)
+
+        Path(self.address).parent.mkdir(parents=True, exist_ok=True)
+        Path(self.address).unlink(missing_ok=True)
+        server = socketserver.ThreadingUnixStreamServer(self.address, JobHandler)
+        os.chmod(self.address, 0o600)
+        return server
+
+    @staticmethod
+    def _check_loopback(host: str) -> None:
+        # Los trabajos leen y escriben rutas arbitrarias sin autenticación: solo se escucha en local.
+        try:
+            addresses = {info[4][0] for info in socket.getaddrinfo(host, None)}
+        except socket.gaierror as e:
+            error_msg = f"Dirección del servidor no válida {host}: {e}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+        if not all(ipaddress.ip_address(address.split("%")[0]).is_loopback for address in addresses):
+            error_msg = f"El servidor solo puede escuchar en una dirección local, no en {host}"
+            logger.error(error_msg)
+            raise CapituladorError(error_msg)
+
+
+class BuildClient:
+    def __init__(self, address: Optional[str] = None):
+        self.address = address or settings.SERVER_ADDRESS
+
+    def is_available(self) -> bool:
+        try:
+            with self._connect():
+                return True
+        except OSError:
+            return False
+
+    def submit(self, job: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        job = dict(job)
+        for key in ("source", "output"):
+            if job.get(key):
+                job[key] = str(Path(job[key]).resolve())
+
+        cancellation = CancellationToken.current.get()
+        with self._connect() as connection:
+            if cancellation is not None:
+                cancellation.add_callback(lambda: self._shutdown(connection))
+            connection.sendall((json.dumps(job, ensure_ascii=False) + "\n").encode("utf-8"))
+            with connection.makefile("r", encoding="utf-8") as reader:
+                for line in reader:
+                    yield json.loads(line)
+        if cancellation is not None:
+            cancellation.check()
+
+    def build(self, job: Dict[str, Any], progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, str]:
+        try:
+            for event in self.submit(job):
+                if progress is not None:
+                    progress(event)
+                if event["event"] == "done":
+                    return event["artifacts"]
+                if event["event"] == "error":
+                    raise CapituladorError(event["message"])
+        except OSError as e:
+            raise CapituladorError(f"No se pudo contactar con el servidor en {self.address}: {e}")
+        raise CapituladorError("El servidor cerró la conexión sin terminar el trabajo")
+
+    @staticmethod
+    def _shutdown(connection: socket.socket) -> None:
+        # Al cerrar la conexión el servidor cancela el trabajo.
+        try:
+            connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def _connect(self) -> socket.socket:
+        if BuildServer.TCP_ADDRESS_PATTERN.match(self.address) or not hasattr(socket, "AF_UNIX"):
+            host, port = self.address.rsplit(":", 1)
+            return socket.create_connection((host, int(port)))
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            connection.connect(self.address)
+        except OSError:
+            connection.close()
+            raise
+        return connection
+
+
+class CancellationToken:
+    current: ContextVar = ContextVar("cancellation_token", default=None)
+
+    def __init__(self):
+        self.cancelled = False
+        self._processes: Set[subprocess.Popen] = set()
+        self._callbacks: List[Callable[[], None]] = []
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def activate(self) -> Iterator["CancellationToken"]:
+        token = CancellationToken.current.set(self)
+        try:
+            yield self
+        finally:
+            CancellationToken.current.reset(token)
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+            callbacks, self._callbacks = self._callbacks, []
+        for process in processes:
+            ProcessTree.terminate(process)
+        for callback in callbacks:
+            callback()
+        logger.info("Compilación cancelada")
+
+    def check(self) -> None:
+        if self.cancelled:
+            raise CapituladorError("Compilación cancelada")
+
+    def register(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.add(process)
+        if self.cancelled:
+            ProcessTree.terminate(process)
+
+    def unregister(self, process: subprocess.Popen) -> None:
+        with self._lock:
+            self._processes.discard(process)
+
+    def add_callback(self, callback: Callable[[], None]) -> None:
+        with self._lock:
+            if not self.cancelled:
+                self._callbacks.append(callback)
+                return
+        callback()
+
+
+class ProcessTree:
+    @staticmethod
+    def run(args: List[str], input: Optional[str] = None, check: bool = False, capture_output: bool = False,
+            **kwargs: Any) -> subprocess.CompletedProcess:
+        cancellation = CancellationToken.current.get()
+        if cancellation is None:
+            return subprocess.run(args, input=input, check=check, capture_output=capture_output, **kwargs)
+
+        cancellation.check()
+        if capture_output:
+            kwargs["stdout"] = kwargs["stderr"] = subprocess.PIPE
+        if input is not None:
+            kwargs["stdin"] = subprocess.PIPE
+        process = ProcessTree.start(args, **kwargs)
+        cancellation.register(process)
+        try:
+            stdout, stderr = process.communicate(input)
+        finally:
+            cancellation.unregister(process)
+        cancellation.check()
+        if check and process.returncode:
+            raise subprocess.CalledProcessError(process.returncode, args, stdout, stderr)
+        return subprocess.CompletedProcess(args, process.returncode, stdout, stderr)
+
+    @staticmethod
+    def start(args: List[str], **kwargs: Any) -> subprocess.Popen:
+        if platform.system() == "Windows":
+            kwargs.setdefault("creationflags", subprocess.CREATE_NEW_PROCESS_GROUP)
+        else:
+            kwargs.setdefault("start_new_session", True)
+        return subprocess.Popen(args, **kwargs)
+
+    @staticmethod
+    def terminate(process: subprocess.Popen, timeout: float = 5.0) -> None:
+        if process.poll() is not None:
+            return
+        try:
+            if platform.system() == "Windows":
+                subprocess.run(["taskkill", "/T", "/F", "/PID", str(process.pid)], capture_output=True)
+            else:
+                os.killpg(process.pid, signal.SIGTERM)
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            if platform.system() != "Windows":
+                os.killpg(process.pid, signal.SIGKILL)
+            process.kill()
+            process.wait()
+        except ProcessLookupError:
+            pass
+
+
+class FileWatcher:
+    INOTIFY_MASK = 0x2 | 0x8 | 0x80 | 0x200
+    INOTIFY_EVENT = struct.Struct("iIII")
+
+    def __init__(self, paths: Iterable[str]):
+        self.paths = {Path(path).resolve() for path in paths if path}
+        self._folders: Dict[int, Path] = {}
+        self._state = self._snapshot()
+        self._inotify = self._open_inotify()
+
+    def close(self) -> None:
+        if self._inotify is not None:
+            os.close(self._inotify)
+            self._inotify = None
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        if self._inotify is None:
+            return self._poll(timeout)
+
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            ready, _, _ = select.select([self._inotify], [], [], remaining)
+            if not ready:
+                return False
+            try:
+                data = os.read(self._inotify, 64 * 1024)
+            except BlockingIOError:
+                continue
+            if self._matches(data):
+                return True
+
+    def _matches(self, data: bytes) -> bool:
+        offset = 0
+        while offset < len(data):
+            descriptor, _, _, length = self.INOTIFY_EVENT.unpack_from(data, offset)
+            offset += self.INOTIFY_EVENT.size
+            name = data[offset:offset + length].rstrip(b"\0").decode("utf-8", "replace")
+            offset += length
+            if self._folders.get(descriptor, Path()) / name in self.paths:
+                return True
+        return False
+
+    def _poll(self, timeout: Optional[float]) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            state = self._snapshot()
+            if state != self._state:
+                self._state = state
+                return True
+            remaining = settings.WATCH_POLL_INTERVAL if deadline is None else deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(settings.WATCH_POLL_INTERVAL, remaining))
+
+    def _snapshot(self) -> Dict[Path, Optional[tuple]]:
+        state = {}
+        for path in self.paths:
+            try:
+                stat = path.stat()
+                state[path] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                state[path] = None
+        return state
+
+    def _open_inotify(self) -> Optional[int]:
+        if platform.system() != "Linux":
+            return None
+        try:
+            import ctypes
+            import ctypes.util
+
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            descriptor = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if descriptor < 0:
+                return None
+            for folder in {path.parent for path in self.paths}:
+                watch = libc.inotify_add_watch(descriptor, os.fsencode(folder), self.INOTIFY_MASK)
+                if watch < 0:
+                    os.close(descriptor)
+                    return None
+                self._folders[watch] = folder
+            return descriptor
+        except (OSError, AttributeError):
+            return None
+
+
+class BuildWatcher:
+    def __init__(self, build_args: Optional[List[str]] = None):
+        self.build_args = build_args or []
+        self._started = 0.0
+
+    def watched_files(self) -> List[str]:
+        return [settings.SOURCE_FILE, settings_provider.env_file, str(Path(__file__).parent / "config" / "schema.py")]
+
+    def run(self) -> None:
+        watcher = FileWatcher(self.watched_files())
+        logger.info(f"Vigilando cambios en: {', '.join(str(path) for path in sorted(watcher.paths))}")
+        build = self._start_build()
+        try:
+            while True:
+                changed = watcher.wait(settings.WATCH_POLL_INTERVAL if build is not None else None)
+                if build is not None and build.poll() is not None:
+                    self._report(build)
+                    build = None
+                if not changed:
+                    continue
+
+                while watcher.wait(settings.WATCH_DEBOUNCE):
+                    pass
+                if build is not None:
+                    logger.info("Cambios nuevos: cancelando la construcción en curso")
+                    ProcessTree.terminate(build)
+                build = self._start_build()
+        finally:
+            if build is not None:
+                ProcessTree.terminate(build)
+            watcher.close()
+
+    def _start_build(self) -> subprocess.Popen:
+        logger.info("Reconstruyendo...")
+        self._started = time.perf_counter()
+        return ProcessTree.start([sys.executable, str(Path(__file__).resolve()), "build", *self.build_args])
+
+    def _report(self, build: subprocess.Popen) -> None:
+        elapsed = time.perf_counter() - self._started
+        if build.returncode == 0:
+            logger.info(f"Construcción actualizada en {elapsed:.2f}s")
+        else:
+            logger.error(f"La construcción falló (código {build.returncode}) tras {elapsed:.2f}s")
 
 
 def main() -> None:
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Procesa el manuscrito y genera PDF, capítulos y eBook.")
+    parser.add_argument(
+        "command", nargs="?", default="build", choices=["build", "serve", "batch", "watch", "backups", "restore"],
+        help="build: construye el manuscrito (por defecto); serve: arranca el servidor de construcción; "
+             "batch: construye todos los libros de un manifiesto; watch: reconstruye al guardar cambios; "
+             "backups: lista las versiones guardadas; restore: recupera una versión")
+    parser.add_argument(
+        "target", nargs="?", metavar="OBJETIVO",
+        help="manifiesto JSON (batch) o fecha, nombre o hash de la versión a recuperar (restore)")
+    parser.add_argument("--to", help="archivo donde escribir la versión recuperada (restore)")
+    parser.add_argument("--workers", type=int, help="libros construidos a la vez en modo batch")
+    parser.add_argument(
+        "--formats", nargs="+", choices=Capitulador.BUILD_FORMATS, metavar="FORMATO",
+        help=f"formatos a generar ({', '.join(Capitulador.BUILD_FORMATS)}; por defecto todos)")
+    parser.add_argument(
+        "--server", action="store_true",
+        help="envía la construcción al servidor en ejecución en lugar de hacerla en este proceso")
+    parser.add_argument(
+        "--draft", nargs="*", type=int, metavar="N",
+        help="compila solo los capítulos indicados (sin números: los modificados desde el último borrador)")
+    parser.add_argument(
+        "--stream", action="store_true",
+        help="procesa el manuscrito línea a línea hasta el PDF, con memoria acotada")
+    args = parser.parse_args()
+
     try:
+        if args.command == "serve":
+            BuildServer().serve_forever()
+            return
+        if args.command == "watch":
+            build_args = ["--formats", *args.formats] if args.formats else []
+            if args.draft is not None:
+                build_args += ["--draft", *map(str, args.draft)]
+            BuildWatcher(build_args).run()
+            return
+        if args.command == "backups":
+            for backup in BackupManager.list_backups():
+                print(f"{backup['name']}  {backup['source']}")
+            return
+        if args.command == "restore":
+            if not args.target:
+                parser.error("restore necesita la fecha, el nombre o el hash de la versión")
+            BackupManager.restore_backup(args.target, args.to)
+            return
+        if args.command == "batch":
+            if not args.target:
+                parser.error("batch necesita la ruta del manifiesto")
+            results = BatchBuilder(args.target, args.workers).run()
+            if any(result["error"] is not None for result in results):
+                exit(1)
+            return
+        if args.server:
+            artifacts = BuildClient().build(
+                {"source": settings.SOURCE_FILE, "formats": args.formats},
+                lambda event: logger.info(f"Servidor: {event}"))
+            for name, path in artifacts.items():
+                logger.info(f"Generado: {path}")
+            return
+        
+        # El modo watch detiene la construcción con SIGTERM: como Ctrl+C, para que se limpien los temporales.
+        signal.signal(signal.SIGTERM, signal.default_int_handler)
         capitulador = Capitulador()
-        capitulador.process_manuscript()
+        if args.draft is not None:
+            capitulador.build_draft(args.draft)
+        elif args.stream:
+            capitulador.process_streaming()
+        else:
+            capitulador.process_manuscript(formats=args.formats)
     except CapituladorError as e:
         logger.error(f"Error del Capitulador: {e}")
         exit(1)
@@ -1,86 +1,106 @@
-from pydantic_settings import BaseSettings
-
-
-class CommonSettings(BaseSettings):
-    PROGRAM_NAME: str = 'Capitulador'
-    PROGRAM_VERSION: str = '0.0.1'
-    DEBUG_MODE: bool = False
-    ENV: str = 'dev'
-
-
-class BookSettings(BaseSettings):
-    TITLE: str
-    ALIAS: str
-    AUTHORS: str
-    LANGUAGE: str
-    PUBLISHER: str
-    DESCRIPTION: str
-    IDENTIFIER: str
-    PUBDATE: str
-    SUBJECT: str
-    PAGES: str
-    COVER: str
-    COMMENTS: str
-
-    class Config:
-        env_file = f'config/{CommonSettings().ENV}.env'
-
-
-class PathSettings(BaseSettings):
-    SOURCE_FILE: str = ""
-    
-    @property
-    def AZW3_FILE(self) -> str:
-        return f"generated/{BookSettings().ALIAS}.azw3"
-    
-    @property
-    def LATEX_FILE(self) -> str:
-        return f"generated/{BookSettings().ALIAS}.tex"
-    
-    @property
-    def PDF_FILE(self) -> str:
-        return f"generated/{BookSettings().ALIAS}.pdf"
-    
-    @property
-    def AUX_FILE(self) -> str:
-        return f"generated/{BookSettings().ALIAS}.aux"
-    
-    @property
-    def LOG_FILE(self) -> str:
-        return f"generated/{BookSettings().ALIAS}.log"
-    
-    BACKUPS_FOLDER: str = "generated/backups"
-
-
-class LaTexSettings(BaseSettings):
-    LATEX_BEGIN: str = r"""\pdfminorversion=4
-\documentclass[]{book}
-\usepackage[T1]{fontenc}
-\usepackage{lmodern}
-\usepackage[utf8]{inputenc}
-\usepackage[spanish]{babel}
-\usepackage{amssymb,latexsym,amsmath}
-\usepackage[a4paper,top=3cm,bottom=2cm,left=3cm,right=3cm,marginparwidth=1.75cm]{geometry}
-\usepackage{graphicx}
-\usepackage{bookmark}
-\usepackage{titlesec}
-
-\titleformat{\section}[block]{\normalfont\Large\bfseries}{}{0pt}{}
-\titleformat{\subsection}[block]{\normalfont\large\bfseries}{}{0pt}{}
-\titleformat{\subsubsection}[block]{\normalfont\large\bfseries}{}{0pt}{}
-
-\begin{document}
-
-"""
-    LATEX_END: str = r"""
-
-\end{document}
-"""
-
-
-class Settings(CommonSettings, LaTexSettings, PathSettings, BookSettings):
-    class Config:
-        env_file = f'config/{CommonSettings().ENV}.env'
-
-
-settings = Settings()
\ No newline at end of file
+import hashlib
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Iterator, Optional, Tuple
+
+if TYPE_CHECKING:
+    from config.schema import Settings
+
+ENV_FILE = f'config/{os.environ.get("ENV", "dev")}.env'
+SCHEMA_NAMES = {
+    "CommonSettings", "BookSettings", "PathSettings", "BuildSettings", "LaTexSettings", "Settings"}
+
+
+def __getattr__(name: str):
+    if name in SCHEMA_NAMES:
+        from config import schema
+        return getattr(schema, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class SettingsProvider:
+    # Segundos entre comprobaciones del archivo .env; reload() lo relee al momento.
+    CHECK_INTERVAL = 1.0
+
+    def __init__(self, env_file: str = ENV_FILE):
+        self.env_file = env_file
+        self._settings = None
+        self._file_state: Optional[Tuple[int, int]] = None
+        self._next_check = 0.0
+        self._file_hash: Optional[str] = None
+        self._lock = threading.Lock()
+        self._override: ContextVar = ContextVar(f"settings_override_{id(self)}", default=None)
+
+    def get(self) -> "Settings":
+        override = self._override.get()
+        if override is not None:
+            return override
+        now = time.monotonic()
+        if self._settings is None or now >= self._next_check:
+            file_state = self._read_file_state()
+            if self._settings is None or file_state != self._file_state:
+                with self._lock:
+                    if self._settings is None or file_state != self._file_state:
+                        self._load(file_state)
+            self._next_check = now + self.CHECK_INTERVAL
+        return self._settings
+
+    def reload(self) -> "Settings":
+        with self._lock:
+            self._settings = None
+            self._load(self._read_file_state())
+        return self._settings
+
+    @contextmanager
+    def override(self, env_file: Optional[str] = None, **values) -> Iterator["Settings"]:
+        from config.schema import Settings
+
+        base = self.get() if env_file is None else Settings(_env_file=env_file)
+        overridden = Settings.model_construct(**{**base.model_dump(), **values})
+        token = self._override.set(overridden)
+        try:
+            yield overridden
+        finally:
+            self._override.reset(token)
+
+    def _load(self, file_state: Optional[Tuple[int, int]]) -> None:
+        file_hash = self._read_file_hash()
+        if self._settings is None or file_hash != self._file_hash:
+            from config.schema import Settings
+
+            self._settings = Settings(_env_file=self.env_file)
+            self._file_hash = file_hash
+        self._file_state = file_state
+        self._next_check = time.monotonic() + self.CHECK_INTERVAL
+
+    def _read_file_state(self) -> Optional[Tuple[int, int]]:
+        try:
+            stat = os.stat(self.env_file)
+            return stat.st_mtime_ns, stat.st_size
+        except OSError:
+            return None
+
+    def _read_file_hash(self) -> Optional[str]:
+        try:
+            with open(self.env_file, "rb") as file:
+                return hashlib.sha256(file.read()).hexdigest()
+        except OSError:
+            return None
+
+
+class SettingsProxy:
+    def __init__(self, provider: SettingsProvider):
+        object.__setattr__(self, "_provider", provider)
+
+    def __getattr__(self, name: str):
+        return getattr(self._provider.get(), name)
+
+    def __setattr__(self, name: str, value) -> None:
+        raise AttributeError(f"settings es de solo lectura: usa settings_provider.override({name}=...)")
+
+
+settings_provider = SettingsProvider()
+settings = SettingsProxy(settings_provider)
\ No newline at end of file
@@ -0,0 +1,120 @@
+from functools import cached_property
+
+from pydantic_settings import BaseSettings
+
+from config.config import ENV_FILE, settings_provider
+
+
+class CommonSettings(BaseSettings):
+    PROGRAM_NAME: str = 'Capitulador'
+    PROGRAM_VERSION: str = '0.0.1'
+    DEBUG_MODE: bool = False
+    ENV: str = 'dev'
+
+
+class BookSettings(BaseSettings):
+    TITLE: str
+    ALIAS: str
+    AUTHORS: str
+    LANGUAGE: str
+    PUBLISHER: str
+    DESCRIPTION: str
+    IDENTIFIER: str
+    PUBDATE: str
+    SUBJECT: str
+    PAGES: str
+    COVER: str
+    COMMENTS: str
+
+    class Config:
+        env_file = ENV_FILE
+
+
+class PathSettings(BaseSettings):
+    SOURCE_FILE: str = ""
+    OUTPUT_FOLDER: str = "generated"
+    
+    @cached_property
+    def WORK_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/work.md"
+    
+    @cached_property
+    def CHAPTERS_FOLDER(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/chapters"
+    
+    @cached_property
+    def AZW3_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.azw3"
+    
+    @cached_property
+    def EPUB_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.epub"
+    
+    @cached_property
+    def LATEX_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.tex"
+    
+    @cached_property
+    def PDF_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.pdf"
+    
+    @cached_property
+    def AUX_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.aux"
+    
+    @cached_property
+    def LOG_FILE(self) -> str:
+        return f"{self.OUTPUT_FOLDER}/{self._alias()}.log"
+    
+    BACKUPS_FOLDER: str = "generated/backups"
+    CACHE_FOLDER: str = "generated/cache"
+    
+    def _alias(self) -> str:
+        return getattr(self, "ALIAS", None) or settings_provider.get().ALIAS
+
+
+class BuildSettings(BaseSettings):
+    CONVERSION_WORKERS: int = 0
+    MANUSCRIPT_MMAP_THRESHOLD: int = 64 * 1024 * 1024
+    BUILD_CACHE_MAX_MB: int = 500
+    BUILD_CACHE_MAX_ENTRIES: int = 20
+    BUILD_CACHE_HARDLINKS: bool = False
+    SERVER_ADDRESS: str = "generated/capitulador.sock"
+    SERVER_MAX_JOBS: int = 2
+    BATCH_WORKERS: int = 2
+    WATCH_DEBOUNCE: float = 0.5
+    WATCH_POLL_INTERVAL: float = 0.5
+
+
+class LaTexSettings(BaseSettings):
+    LATEX_FORMAT_CACHE: bool = True
+    LATEX_NATIVE_CONVERTER: bool = True
+    LATEX_MAX_PASSES: int = 3
+    LATEX_BEGIN: str = r"""\pdfminorversion=4
+\documentclass[]{book}
+\usepackage[T1]{fontenc}
+\usepackage{lmodern}
+\usepackage[utf8]{inputenc}
+\usepackage[spanish]{babel}
+\usepackage{amssymb,latexsym,amsmath}
+\usepackage[a4paper,top=3cm,bottom=2cm,left=3cm,right=3cm,marginparwidth=1.75cm]{geometry}
+\usepackage{graphicx}
+\usepackage{bookmark}
+\usepackage{titlesec}
+
+\titleformat{\section}[block]{\normalfont\Large\bfseries}{}{0pt}{}
+\titleformat{\subsection}[block]{\normalfont\large\bfseries}{}{0pt}{}
+\titleformat{\subsubsection}[block]{\normalfont\large\bfseries}{}{0pt}{}
+
+\begin{document}
+
+"""
+    LATEX_END: str = r"""
+
+\end{document}
+"""
+
+
+class Settings(CommonSettings, BuildSettings, LaTexSettings, PathSettings, BookSettings):
+    class Config:
+        env_file = ENV_FILE
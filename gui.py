@@ -1,16 +1,164 @@
 import tkinter as tk
-from tkinter import ttk, filedialog, scrolledtext, messagebox
-from threading import Thread
+from tkinter import ttk, filedialog, scrolledtext, messagebox, simpledialog
+from threading import Lock, Thread
+from bisect import bisect_left, bisect_right
+import hashlib
 import os
 import re
-import subprocess
 from pathlib import Path
 
-from capitulador import Capitulador
-from config.config import BookSettings
+from capitulador import (
+    BuildClient, CancellationToken, Capitulador, ChapterGenerator, DraftBuilder, FileHandler, Manuscript,
+    ManuscriptIndex)
+from config.config import settings, settings_provider
+
+
+class ManuscriptOutline:
+    def __init__(self):
+        self.reset("")
+    
+    def reset(self, text):
+        index = ManuscriptIndex(text)
+        self.line_words = index.line_words
+        self.chapter_lines = [chapter.header_line for chapter in index.chapters]
+        self.chapter_numbers = [chapter.number for chapter in index.chapters]
+        self.chapter_word_counts = [chapter.words for chapter in index.chapters]
+        self.title_lines = [line for line, _ in index.title_lines]
+        self.titles = [title for _, title in index.title_lines]
+        self.touched = set(self.chapter_numbers)
+        self.total = index.words
+    
+    def replace_lines(self, first, old_count, new_lines):
+        scanned = [ManuscriptIndex.scan_line(line) for line in new_lines]
+        new_counts = [words for _, _, words in scanned]
+        self.total += sum(new_counts) - sum(self.line_words[first:first + old_count])
+        self.line_words[first:first + old_count] = new_counts
+        
+        headers, titles = [], []
+        for offset, (number, title, _) in enumerate(scanned):
+            if number is not None:
+                headers.append((first + offset, number, None))
+            elif title is not None:
+                titles.append((first + offset, title))
+        shift = len(new_lines) - old_count
+        self._splice(self.chapter_lines, first, old_count, shift, headers,
+                     self.chapter_numbers, self.chapter_word_counts)
+        self._splice(self.title_lines, first, old_count, shift, titles, self.titles)
+        
+        if self.chapter_lines:
+            start = self.chapter_at_line(max(first - 1, 0))
+            last = self.chapter_at_line(first + max(len(new_lines), 1) - 1)
+            if start == 0:
+                last = min(last + 1, len(self.chapter_lines) - 1)
+            for chapter in range(start, last + 1):
+                self.chapter_word_counts[chapter] = None
+                self.touched.add(self.chapter_numbers[chapter])
+    
+    def replace_changed(self, old_lines, new_lines):
+        first = 0
+        limit = min(len(old_lines), len(new_lines))
+        while first < limit and old_lines[first] == new_lines[first]:
+            first += 1
+        old_end, new_end = len(old_lines), len(new_lines)
+        while old_end > first and new_end > first and old_lines[old_end - 1] == new_lines[new_end - 1]:
+            old_end -= 1
+            new_end -= 1
+        if old_end > first or new_end > first:
+            self.replace_lines(first, old_end - first, new_lines[first:new_end])
+    
+    @staticmethod
+    def _splice(lines, first, old_count, shift, entries, *columns):
+        start = bisect_left(lines, first)
+        end = bisect_left(lines, first + old_count)
+        following = [line + shift for line in lines[end:]] if shift else lines[end:]
+        lines[start:] = [entry[0] for entry in entries] + following
+        for column, values in enumerate(columns, 1):
+            values[start:end] = [entry[column] for entry in entries]
+    
+    def chapter_span(self, chapter):
+        start = self.chapter_lines[chapter] if chapter else 0
+        end = self.chapter_lines[chapter + 1] if chapter + 1 < len(self.chapter_lines) else len(self.line_words)
+        return start, end
+    
+    def chapter_words(self, chapter):
+        if self.chapter_word_counts[chapter] is None:
+            start, end = self.chapter_span(chapter)
+            self.chapter_word_counts[chapter] = sum(self.line_words[start:end])
+        return self.chapter_word_counts[chapter]
+    
+    def chapter_title(self, chapter):
+        _, end = self.chapter_span(chapter)
+        index = bisect_left(self.title_lines, self.chapter_lines[chapter])
+        if index < len(self.title_lines) and self.title_lines[index] < end:
+            return self.titles[index]
+        return None
+    
+    def chapter_at_line(self, line):
+        return max(bisect_right(self.chapter_lines, line) - 1, 0) if self.chapter_lines else None
+    
+    def next_chapter_number(self):
+        return max(self.chapter_numbers, default=0) + 1
+
+
+class SnapshotSearch:
+    def __init__(self, text):
+        self.text = text
+        self._line_starts = None
+    
+    def find(self, pattern, is_cancelled):
+        if self._line_starts is None:
+            self._line_starts = [0] + [match.end() for match in re.finditer("\n", self.text)]
+        positions = []
+        for count, match in enumerate(pattern.finditer(self.text)):
+            if count % 256 == 0 and is_cancelled():
+                return None
+            if match.end() > match.start():
+                positions.append((self._position(match.start()), self._position(match.end())))
+        return positions
+    
+    def _position(self, offset):
+        line = bisect_right(self._line_starts, offset) - 1
+        return line + 1, offset - self._line_starts[line]
+
+
+class BuildJob:
+    PARTIAL_KINDS = ("pdf", "chapters", "ebook")
+    
+    def __init__(self, kind, label, output_folder, snapshot, chapters=None):
+        self.kind = kind
+        self.label = label
+        self.output_folder = output_folder
+        self.snapshot = snapshot
+        self.chapters = chapters
+        self.token = CancellationToken()
+        self.status = "En cola"
+        self.item = None
+    
+    def key(self):
+        return self.kind, str(self.output_folder), tuple(self.chapters or ())
+    
+    def covers(self, other):
+        if self.key() == other.key():
+            return True
+        return self.kind == "all" and other.kind in self.PARTIAL_KINDS and self.output_folder == other.output_folder
+    
+    @staticmethod
+    def merge_snapshots(older, newer):
+        content, file_path, generation = newer
+        return content, file_path, older[2] if generation is None else generation
 
 
 class CapituladorGUI:
+    LOAD_CHUNK_SIZE = 256 * 1024
+    MAX_JOB_HISTORY = 20
+    BUILD_JOBS = {
+        "all": ("Todo", "Procesando", "Error", "_run_process_all"),
+        "pdf": ("PDF", "Generando PDF", "Error generando PDF", "_run_generate_pdf"),
+        "chapters": ("Capítulos", "Generando capítulos", "Error generando capítulos", "_run_generate_chapters"),
+        "ebook": ("eBook", "Generando eBook", "Error generando eBook", "_run_generate_ebook"),
+        "draft": ("Borrador", "Generando borrador", "Error generando borrador", "_run_generate_draft"),
+    }
+    
     def __init__(self):
         self.root = tk.Tk()
         self.root.title("Capitulador")
@@ -20,10 +168,26 @@ class CapituladorGUI:
         self.file_path = None
         self.is_modified = False
         self.capitulador = Capitulador()
-        self.book_settings = BookSettings()
+        self.book_settings = settings
         self.animation_job = None
+        self.outline = ManuscriptOutline()
+        self._outline_rows = []
+        self._built_hashes = None
+        self._dirty_chapters = set()
+        self._status_job = None
         self.search_positions = []
         self.current_search_index = -1
+        self._search_job = None
+        self._search_generation = 0
+        self._search_snapshot = None
+        self._buffer_version = 0
+        self._loading = False
+        self._load_generation = 0
+        self._save_generation = 0
+        self._save_lock = Lock()
+        self._save_threads = []
+        self.build_queue = []
+        self._running_job = None
         
         self._setup_ui()
         self._show_welcome_message()
@@ -53,6 +217,7 @@ class CapituladorGUI:
         edit_menu.add_separator()
         edit_menu.add_command(label="Metadatos", command=self._edit_metadata, accelerator="Ctrl+M")
         edit_menu.add_command(label="Nuevo capítulo", command=self._insert_chapter, accelerator="Ctrl+N")
+        edit_menu.add_command(label="Renumerar capítulos", command=self._renumber_chapters)
         edit_menu.add_command(label="Salto de página", command=self._insert_page_break, accelerator="Ctrl+P")
         
         process_menu = tk.Menu(menubar, tearoff=0)
@@ -61,6 +226,9 @@ class CapituladorGUI:
         process_menu.add_command(label="PDF", command=self._generate_pdf, accelerator="F6")
         process_menu.add_command(label="Capítulos", command=self._generate_chapters, accelerator="F7")
         process_menu.add_command(label="eBook", command=self._generate_ebook, accelerator="F8")
+        process_menu.add_command(label="Borrador", command=self._generate_draft, accelerator="F9")
+        process_menu.add_separator()
+        process_menu.add_command(label="Cancelar", command=self._cancel_builds, accelerator="Ctrl+.")
     
     def _create_toolbar(self):
         toolbar = ttk.Frame(self.root)
@@ -75,7 +243,8 @@ class CapituladorGUI:
             (None, None),
             ("🔄 Todo", self._process_all),
             ("📖 PDF", self._generate_pdf),
-            ("📚 eBook", self._generate_ebook)
+            ("📚 eBook", self._generate_ebook),
+            ("⏹ Cancelar", self._cancel_builds)
         ]
         
         for text, command in buttons:
@@ -95,6 +264,13 @@ class CapituladorGUI:
         self.search_entry = ttk.Entry(self.search_frame, textvariable=self.search_var, width=20)
         self.search_entry.pack(side=tk.LEFT, padx=2)
         
+        self.search_regex_var = tk.BooleanVar(value=False)
+        self.search_word_var = tk.BooleanVar(value=False)
+        ttk.Checkbutton(self.search_frame, text=".*", variable=self.search_regex_var,
+                        command=self._schedule_search).pack(side=tk.LEFT, padx=1)
+        ttk.Checkbutton(self.search_frame, text="Palabra", variable=self.search_word_var,
+                        command=self._schedule_search).pack(side=tk.LEFT, padx=1)
+        
         for text, command in [("▲", self._search_previous), ("▼", self._search_next), ("✕", self._hide_search)]:
             ttk.Button(self.search_frame, text=text, command=command, width=3).pack(side=tk.LEFT, padx=1)
 
@@ -105,12 +281,84 @@ class CapituladorGUI:
         self.search_frame.pack_forget()
     
     def _create_editor(self):
+        panes = ttk.PanedWindow(self.root, orient=tk.HORIZONTAL)
+        panes.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        sidebar = ttk.Frame(panes)
+        panes.add(sidebar, weight=0)
+        
+        self.outline_tree = ttk.Treeview(sidebar, columns=("words", "state"), selectmode="browse")
+        self.outline_tree.heading("#0", text="Capítulos")
+        self.outline_tree.heading("words", text="Palabras")
+        self.outline_tree.column("#0", width=180)
+        self.outline_tree.column("words", width=70, anchor=tk.E)
+        self.outline_tree.column("state", width=20, anchor=tk.CENTER)
+        self.outline_tree.bind("<<TreeviewSelect>>", self._jump_to_chapter)
+        self.outline_tree.pack(fill=tk.BOTH, expand=True)
+        
+        self.jobs_tree = ttk.Treeview(sidebar, columns=("status",), height=5, selectmode="none")
+        self.jobs_tree.heading("#0", text="Compilaciones")
+        self.jobs_tree.heading("status", text="Estado")
+        self.jobs_tree.column("#0", width=180)
+        self.jobs_tree.column("status", width=90)
+        self.jobs_tree.pack(fill=tk.X, pady=(5, 0))
+        
         self.text_editor = scrolledtext.ScrolledText(
-            self.root, wrap=tk.WORD, undo=True, font=("monospace", 11),
+            panes, wrap=tk.WORD, undo=True, font=("monospace", 11),
             padx=15, pady=15, relief=tk.FLAT, borderwidth=1)
-        self.text_editor.pack(fill=tk.BOTH, expand=True, padx=10, pady=5)
+        panes.add(self.text_editor, weight=1)
+        self.text_editor.tag_configure("search_highlight", background="#FFE135", foreground="black")
+        self.text_editor.tag_configure("search_current", background="#FF6B35", foreground="white")
+        self.text_editor.tag_raise("search_current", "search_highlight")
         self.text_editor.bind("<Key>", self._on_text_change)
         self.text_editor.bind("<KeyRelease>", self._update_status, add="+")
+        self.text_editor.bind("<ButtonRelease-1>", self._update_status, add="+")
+        self._install_text_proxy()
+    
+    def _install_text_proxy(self):
+        widget = str(self.text_editor)
+        self._text_command = f"{widget}_original"
+        self.root.tk.call("rename", widget, self._text_command)
+        self.root.tk.createcommand(widget, self._text_proxy)
+    
+    def _text_proxy(self, *args):
+        call = self.root.tk.call
+        if args[:2] in (("edit", "undo"), ("edit", "redo")):
+            old_text = str(call(self._text_command, "get", "1.0", "end-1c"))
+            result = call((self._text_command,) + args)
+            self._buffer_version += 1
+            new_text = str(call(self._text_command, "get", "1.0", "end-1c"))
+            self.outline.replace_changed(old_text.split("\n"), new_text.split("\n"))
+            self._update_status()
+            return result
+        if not args or args[0] not in ("insert", "delete", "replace"):
+            return call((self._text_command,) + args)
+        
+        old_total = self._text_line(call(self._text_command, "index", "end-1c"))
+        if args[0] == "insert":
+            indexes = args[1:2]
+        elif args[0] == "replace":
+            indexes = args[1:3]
+        else:
+            indexes = args[1:] if len(args) > 2 else (args[1], f"{args[1]}+1c")
+        lines = [min(self._text_line(call(self._text_command, "index", index)), old_total) for index in indexes]
+        first, last = min(lines), max(lines)
+        
+        result = call((self._text_command,) + args)
+        self._buffer_version += 1
+        if self.search_var.get() and self.search_frame.winfo_ismapped():
+            self._schedule_search()
+        
+        new_total = self._text_line(call(self._text_command, "index", "end-1c"))
+        new_last = last + new_total - old_total
+        text = call(self._text_command, "get", f"{first}.0", f"{new_last}.end")
+        self.outline.replace_lines(first - 1, last - first + 1, str(text).split("\n"))
+        if len(self.outline.line_words) != new_total:
+            self.outline.reset(str(call(self._text_command, "get", "1.0", "end-1c")))
+        self._update_status()
+        return result
+    
+    def _text_line(self, index):
+        return int(str(index).split(".")[0])
     
     def _create_status_bar(self):
         status_frame = ttk.Frame(self.root)
@@ -130,7 +378,8 @@ class CapituladorGUI:
             ("<Control-m>", self._edit_metadata), ("<Control-n>", self._insert_chapter),
             ("<Control-p>", self._insert_page_break), ("<Control-f>", self._toggle_search),
             ("<F5>", self._process_all), ("<F6>", self._generate_pdf),
-            ("<F7>", self._generate_chapters), ("<F8>", self._generate_ebook)
+            ("<F7>", self._generate_chapters), ("<F8>", self._generate_ebook),
+            ("<F9>", self._generate_draft), ("<Control-period>", self._cancel_builds)
         ]
         for key, cmd in shortcuts:
             self.root.bind(key, lambda e, c=cmd: c())
@@ -176,22 +425,62 @@ Una vez abierto el archivo, podrás:
             filetypes=[("Archivos de texto", "*.txt"), ("Archivos Markdown", "*.md"), ("Todos", "*.*")])
         
         if file_path:
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read()
-                self.text_editor.config(state='normal')
-                self.text_editor.delete(1.0, tk.END)
-                self.text_editor.insert(1.0, content)
-                self.text_editor.edit_reset()
-                self.file_path = file_path
-                self.is_modified = False
-                self._update_title()
-                self._update_status()
-                self._set_status(f"Archivo abierto: {os.path.basename(file_path)}", "success")
-            except Exception as e:
-                self._set_status(f"Error abriendo archivo: {e}", "error")
+            self._load_generation += 1
+            self._set_status(f"Abriendo {os.path.basename(file_path)}...", "processing")
+            Thread(target=self._read_file, args=(file_path, self._load_generation), daemon=True).start()
+    
+    def _read_file(self, file_path, generation):
+        try:
+            content = FileHandler.read_file(file_path)
+            self.root.after(0, lambda: self._start_loading(file_path, content, generation))
+        except Exception as e:
+            error_msg = str(e)
+            self.root.after(0, lambda: self._set_status(f"Error abriendo archivo: {error_msg}", "error"))
+    
+    def _start_loading(self, file_path, content, generation):
+        if generation != self._load_generation:
+            return
+        self._loading = True
+        self.text_editor.config(state='normal', undo=False)
+        self.text_editor.delete(1.0, tk.END)
+        self.text_editor.config(state='disabled')
+        self.file_path = file_path
+        self.is_modified = False
+        self._built_hashes = None
+        self._dirty_chapters.clear()
+        self._update_title()
+        self._insert_chunk(content, 0, generation)
+    
+    def _insert_chunk(self, content, start, generation):
+        if generation != self._load_generation:
+            return
+        end = start + self.LOAD_CHUNK_SIZE
+        if end < len(content):
+            end = content.rfind("\n", start, end) + 1 or end
+        else:
+            end = len(content)
+        
+        self.text_editor.config(state='normal')
+        self.text_editor.insert(tk.END + "-1c", content[start:end])
+        self.text_editor.config(state='disabled')
+        
+        filename = os.path.basename(self.file_path)
+        if end < len(content):
+            self._set_status(f"Abriendo {filename}... {end * 100 // len(content)}%", "processing")
+            self.root.after(1, lambda: self._insert_chunk(content, end, generation))
+            return
+        
+        self._loading = False
+        self.text_editor.config(state='normal', undo=True)
+        self.text_editor.edit_reset()
+        self.text_editor.mark_set(tk.INSERT, 1.0)
+        self.text_editor.see(1.0)
+        self._update_status()
+        self._set_status(f"Archivo abierto: {filename}", "success")
     
-    def _save_file(self):
+    def _save_file(self, wait=False):
+        if self._loading:
+            return
         if not self.file_path:
             file_path = filedialog.asksaveasfilename(
                 title="Guardar archivo",
@@ -200,36 +489,77 @@ Una vez abierto el archivo, podrás:
             if not file_path:
                 return
             self.file_path = file_path
-            
-        try:
-            content = self.text_editor.get(1.0, tk.END + "-1c")
-            Path(self.file_path).parent.mkdir(parents=True, exist_ok=True)
-            with open(self.file_path, 'w', encoding='utf-8') as f:
-                f.write(content)
-            self.is_modified = False
-            self._update_title()
-            self._set_status("Archivo guardado", "success")
-        except Exception as e:
-            self._set_status(f"Error guardando: {e}", "error")
+        
+        self._save_snapshot("Archivo guardado", wait)
 
     def _save_as_file(self):
+        if self._loading:
+            return
         file_path = filedialog.asksaveasfilename(
             title="Guardar archivo como",
             defaultextension=".txt",
             filetypes=[("Archivos de texto", "*.txt"), ("Archivos Markdown", "*.md"), ("Todos", "*.*")])
         
         if file_path:
-            try:
-                content = self.text_editor.get(1.0, tk.END + "-1c")
+            self.file_path = file_path
+            self._save_snapshot(f"Archivo guardado como: {os.path.basename(file_path)}")
+    
+    def _save_snapshot(self, message, wait=False):
+        snapshot = self._take_snapshot(force_save=True)
+        if not wait:
+            self._start_save(snapshot, message)
+            return
+        try:
+            self._write_snapshot(snapshot)
+            self._set_status(message, "success")
+        except Exception as e:
+            self._save_failed(str(e))
+    
+    def _start_save(self, snapshot, message):
+        thread = Thread(target=self._run_save, args=(snapshot, message), daemon=True)
+        self._save_threads = [pending for pending in self._save_threads if pending.is_alive()] + [thread]
+        thread.start()
+    
+    def _run_save(self, snapshot, message):
+        try:
+            self._write_snapshot(snapshot)
+            self.root.after(0, lambda: self._set_status(message, "success"))
+        except Exception as e:
+            error_msg = str(e)
+            self.is_modified = True
+            self.root.after(0, lambda: self._save_failed(error_msg))
+    
+    def _take_snapshot(self, force_save=False):
+        content = self.text_editor.get(1.0, tk.END + "-1c")
+        generation = None
+        if force_save or self.is_modified:
+            self._save_generation += 1
+            generation = self._save_generation
+            self.is_modified = False
+            self._update_title()
+        return content, self.file_path, generation
+    
+    def _write_snapshot(self, snapshot):
+        content, file_path, generation = snapshot
+        with self._save_lock:
+            if generation is not None and generation == self._save_generation:
                 Path(file_path).parent.mkdir(parents=True, exist_ok=True)
-                with open(file_path, 'w', encoding='utf-8') as f:
-                    f.write(content)
-                self.file_path = file_path
-                self.is_modified = False
-                self._update_title()
-                self._set_status(f"Archivo guardado como: {os.path.basename(file_path)}", "success")
-            except Exception as e:
-                self._set_status(f"Error guardando: {e}", "error")
+                FileHandler.write_if_changed(file_path, content)
+    
+    def _save_failed(self, error_msg):
+        self.is_modified = True
+        self._update_title()
+        self._set_status(f"Error guardando: {error_msg}", "error")
+    
+    def _load_snapshot(self, snapshot):
+        try:
+            self._write_snapshot(snapshot)
+        except Exception as e:
+            error_msg = str(e)
+            self.root.after(0, lambda: self._save_failed(error_msg))
+            raise
+        content, file_path, _ = snapshot
+        return Manuscript.from_text(content, file_path)
     
     def _check_unsaved(self):
         if not self.file_path or not self.is_modified:
@@ -240,16 +570,36 @@ Una vez abierto el archivo, podrás:
             "¿Guardar cambios antes de continuar?")
         
         if result is True:
-            self._save_file()
+            self._save_file(wait=True)
             return not self.is_modified
         return result is False
     
     def _close_app(self):
         if self.animation_job:
             self.root.after_cancel(self.animation_job)
-        if self._check_unsaved():
+        if self._status_job:
+            self.root.after_cancel(self._status_job)
+        # Un guardado en curso muere con el intérprete si no se espera a que termine.
+        for thread in self._save_threads:
+            thread.join()
+        if self._check_unsaved() and self._write_queued_snapshots():
+            if self._running_job is not None:
+                self._running_job.token.cancel()
             self.root.destroy()
     
+    def _write_queued_snapshots(self):
+        # Al encolar se da el texto por guardado: hay que escribirlo antes de cerrar.
+        jobs = self.build_queue + ([self._running_job] if self._running_job is not None else [])
+        for job in jobs:
+            if job.snapshot[2] is None:
+                continue
+            try:
+                self._write_snapshot(job.snapshot)
+            except Exception as e:
+                self._save_failed(str(e))
+                return False
+        return True
+    
     def _on_text_change(self, event=None):
         if self.file_path and not self.is_modified:
             self.is_modified = True
@@ -264,12 +614,74 @@ Una vez abierto el archivo, podrás:
             self.root.title("Capitulador - Sin archivo")
     
     def _update_status(self, event=None):
-        try:
-            content = self.text_editor.get(1.0, tk.END + "-1c")
-            words = len(re.findall(r'\b\w+\b', content))
-            self.word_count_var.set(f"Palabras: {words:,}")
-        except:
-            self.word_count_var.set("Palabras: 0")
+        if self._status_job is None:
+            self._status_job = self.root.after(300, self._refresh_word_count)
+    
+    def _refresh_word_count(self):
+        self._status_job = None
+        text = f"Palabras: {self.outline.total:,}"
+        chapter = self.outline.chapter_at_line(self._text_line(self.text_editor.index(tk.INSERT)) - 1)
+        if chapter is not None:
+            number = self.outline.chapter_numbers[chapter]
+            text += f"  ·  Capítulo {number}: {self.outline.chapter_words(chapter):,}"
+        self.word_count_var.set(text)
+        self._refresh_outline()
+    
+    def _refresh_outline(self):
+        self._check_dirty_chapters()
+        rows = []
+        for chapter, number in enumerate(self.outline.chapter_numbers):
+            title = self.outline.chapter_title(chapter)
+            label = f"{number}. {title}" if title else f"Capítulo {number}"
+            state = "●" if number in self._dirty_chapters else ""
+            rows.append((label, (f"{self.outline.chapter_words(chapter):,}", state)))
+        
+        items = self.outline_tree.get_children()
+        if len(items) > len(rows):
+            self.outline_tree.delete(*items[len(rows):])
+        for index, (label, values) in enumerate(rows):
+            if index >= len(items):
+                self.outline_tree.insert("", tk.END, text=label, values=values)
+            elif self._outline_rows[index] != (label, values):
+                self.outline_tree.item(items[index], text=label, values=values)
+        self._outline_rows = rows
+    
+    def _check_dirty_chapters(self):
+        touched, self.outline.touched = self.outline.touched, set()
+        if self._built_hashes is None:
+            return
+        for chapter, number in enumerate(self.outline.chapter_numbers):
+            if number not in touched:
+                continue
+            start, end = self.outline.chapter_span(chapter)
+            last = f"{end + 1}.0" if end < len(self.outline.line_words) else tk.END + "-1c"
+            content = self.text_editor.get(f"{start + 1}.0", last)
+            if hashlib.sha256(content.encode("utf-8")).hexdigest() == self._built_hashes.get(number):
+                self._dirty_chapters.discard(number)
+            else:
+                self._dirty_chapters.add(number)
+    
+    def _jump_to_chapter(self, event=None):
+        selection = self.outline_tree.selection()
+        if not selection:
+            return
+        chapter = self.outline_tree.index(selection[0])
+        if chapter < len(self.outline.chapter_lines):
+            position = f"{self.outline.chapter_lines[chapter] + 1}.0"
+            self.text_editor.mark_set(tk.INSERT, position)
+            self.text_editor.yview(position)
+            self.text_editor.focus_set()
+            self._update_status()
+    
+    def _mark_built(self, manuscript):
+        hashes = {chapter.number: chapter.hash for chapter in manuscript.index.chapters}
+        self.root.after(0, lambda: self._set_built_hashes(hashes))
+    
+    def _set_built_hashes(self, hashes):
+        self._built_hashes = hashes
+        self._dirty_chapters.clear()
+        self.outline.touched.update(self.outline.chapter_numbers)
+        self._update_status()
     
     def _set_status(self, message, status_type="normal"):
         self.status_var.set(message)
@@ -327,7 +739,7 @@ Una vez abierto el archivo, podrás:
         
         def save_metadata():
             try:
-                env_file = Path("config/dev.env")
+                env_file = Path(settings_provider.env_file)
                 new_values = {k: v.get() for k, v in fields.items()}
                 new_values['DESCRIPTION'] = desc_text.get(1.0, tk.END + "-1c")
                 
@@ -357,7 +769,7 @@ Una vez abierto el archivo, podrás:
                 with open(env_file, 'w', encoding='utf-8') as f:
                     f.writelines(updated)
                 
-                self.book_settings = BookSettings()
+                settings_provider.reload()
                 self._set_status("Metadatos actualizados", "success")
                 window.destroy()
             except Exception as e:
@@ -369,15 +781,29 @@ Una vez abierto el archivo, podrás:
         ttk.Button(button_frame, text="Cancelar", command=window.destroy).pack(side=tk.LEFT, padx=5)
     
     def _insert_chapter(self):
-        content = self.text_editor.get(1.0, tk.END + "-1c")
-        chapter_numbers = [int(m.group(1)) for m in re.finditer(r'# Chapter (\d+)', content)]
-        next_number = max(chapter_numbers) + 1 if chapter_numbers else 1
+        next_number = self.outline.next_chapter_number()
         
         template = f"\n\n\\newpage\n\n# Chapter {next_number}\n\n## Chapter title\n\n"
         self.text_editor.insert(tk.END, template)
         self.text_editor.see(tk.END)
         self._mark_modified()
     
+    def _renumber_chapters(self):
+        changes = [
+            (line, current, number) for number, (line, current)
+            in enumerate(zip(self.outline.chapter_lines, self.outline.chapter_numbers), 1) if current != number]
+        if not changes:
+            self._set_status("Los capítulos ya están numerados en orden")
+            return
+        
+        prefix = len("# Chapter ")
+        self.text_editor.edit_separator()
+        for line, current, number in changes:
+            self.text_editor.replace(f"{line + 1}.{prefix}", f"{line + 1}.{prefix + len(str(current))}", str(number))
+        self.text_editor.edit_separator()
+        self._mark_modified()
+        self._set_status(f"{len(changes)} capítulos renumerados", "success")
+    
     def _insert_page_break(self):
         pos = self.text_editor.index(tk.INSERT)
         self.text_editor.insert(pos, "\n\n\\newpage\n\n")
@@ -401,39 +827,77 @@ Una vez abierto el archivo, podrás:
 
     def _hide_search(self):
         self.search_frame.pack_forget()
+        self._search_generation += 1
         self._clear_search_highlights()
         self.text_editor.focus_set()
 
     def _on_search_change(self, *args):
-        search_text = self.search_var.get()
-        if search_text:
-            self._search_text(search_text)
-        else:
-            self._clear_search_highlights()
+        self._schedule_search()
 
-    def _search_text(self, search_text):
+    def _schedule_search(self):
+        if self._search_job is not None:
+            self.root.after_cancel(self._search_job)
+        self._search_job = self.root.after(250, self._start_search)
+
+    def _start_search(self):
+        self._search_job = None
+        self._search_generation += 1
+        generation = self._search_generation
         self._clear_search_highlights()
-        if not search_text:
-            return
         
-        self.text_editor.tag_configure("search_highlight", background="#FFE135", foreground="black")
-        self.text_editor.tag_configure("search_current", background="#FF6B35", foreground="white")
+        query = self.search_var.get()
+        if not query:
+            return
+        if not self.search_regex_var.get():
+            query = re.escape(query)
+        if self.search_word_var.get():
+            query = rf"\b(?:{query})\b"
+        try:
+            pattern = re.compile(query, re.IGNORECASE)
+        except re.error as e:
+            self._set_status(f"Búsqueda no válida: {e}", "error")
+            return
         
-        self.search_positions = []
-        start_pos = "1.0"
-        while True:
-            pos = self.text_editor.search(search_text, start_pos, tk.END, nocase=True)
-            if not pos:
-                break
-            
-            end_pos = f"{pos}+{len(search_text)}c"
-            self.text_editor.tag_add("search_highlight", pos, end_pos)
-            self.search_positions.append((pos, end_pos))
-            start_pos = end_pos
+        if self._search_snapshot is None or self._search_snapshot[0] != self._buffer_version:
+            self._search_snapshot = (self._buffer_version, SnapshotSearch(self.text_editor.get(1.0, tk.END + "-1c")))
+        snapshot = self._search_snapshot[1]
+        Thread(target=self._run_search, args=(snapshot, pattern, generation), daemon=True).start()
+
+    def _run_search(self, snapshot, pattern, generation):
+        positions = snapshot.find(pattern, lambda: generation != self._search_generation)
+        if positions is not None:
+            self.root.after(0, lambda: self._show_search_results(positions, generation))
+
+    def _show_search_results(self, positions, generation):
+        if generation != self._search_generation:
+            return
+        self.search_positions = [(f"{sl}.{sc}", f"{el}.{ec}") for (sl, sc), (el, ec) in positions]
+        self._update_search_counter()
+        if not positions:
+            return
         
-        if self.search_positions:
-            self.current_search_index = 0
+        cursor = tuple(map(int, self.text_editor.index(tk.INSERT).split(".")))
+        self.current_search_index = bisect_left([start for start, _ in positions], cursor) % len(positions)
+        if self.root.focus_get() is self.search_entry:
             self._highlight_current_match()
+        else:
+            self._update_search_counter()
+        
+        first_visible = self._text_line(self.text_editor.index("@0,0"))
+        last_visible = self._text_line(self.text_editor.index(f"@0,{self.text_editor.winfo_height()}"))
+        visible = [match for match, (start, _) in zip(self.search_positions, positions)
+                   if first_visible <= start[0] <= last_visible]
+        hidden = [match for match, (start, _) in zip(self.search_positions, positions)
+                  if not first_visible <= start[0] <= last_visible]
+        self._apply_search_highlights(visible + hidden, generation)
+
+    def _apply_search_highlights(self, ranges, generation):
+        if generation != self._search_generation:
+            return
+        batch, remaining = ranges[:500], ranges[500:]
+        self.text_editor.tag_add("search_highlight", *[index for match in batch for index in match])
+        if remaining:
+            self.root.after(1, lambda: self._apply_search_highlights(remaining, generation))
 
     def _clear_search_highlights(self):
         self.text_editor.tag_remove("search_highlight", "1.0", tk.END)
@@ -478,6 +942,9 @@ Una vez abierto el archivo, podrás:
         self._highlight_current_match()
 
     def _validate_file_selected(self):
+        if self._loading:
+            self._set_status("Espera a que termine de abrirse el archivo")
+            return False
         if not self.file_path:
             messagebox.showwarning(
                 "Sin archivo",
@@ -485,12 +952,6 @@ Una vez abierto el archivo, podrás:
             return False
         return True
 
-    def _get_current_content(self):
-        if self.is_modified:
-            self._save_file()
-        with open(self.file_path, 'r', encoding='utf-8') as f:
-            return f.read()
-    
     def _get_output_folder(self):
         import platform
         system = platform.system()
@@ -518,167 +979,222 @@ Una vez abierto el archivo, podrás:
             for file in output_folder.glob(f"*{ext}"):
                 file.unlink(missing_ok=True)
     
-    def _save_current_content(self):
-        content = self.text_editor.get(1.0, tk.END + "-1c")
-        with open(self.file_path, 'w', encoding='utf-8') as f:
-            f.write(content)
-    
     def _process_all(self):
-        if not self._validate_file_selected():
-            return
-        output_folder = self._get_output_folder()
-        if output_folder:
-            self._save_current_content()
-            Thread(target=self._run_process_all, args=(output_folder,), daemon=True).start()
+        if self._validate_file_selected():
+            self._request_build("all")
     
     def _generate_pdf(self):
-        if not self._validate_file_selected():
-            return
-        output_folder = self._get_output_folder()
-        if output_folder:
-            self._save_current_content()
-            Thread(target=self._run_generate_pdf, args=(output_folder,), daemon=True).start()
+        if self._validate_file_selected():
+            self._request_build("pdf")
     
     def _generate_chapters(self):
-        if not self._validate_file_selected():
-            return
-        output_folder = self._get_output_folder()
-        if output_folder:
-            self._save_current_content()
-            Thread(target=self._run_generate_chapters, args=(output_folder,), daemon=True).start()
+        if self._validate_file_selected():
+            self._request_build("chapters")
     
     def _generate_ebook(self):
+        if self._validate_file_selected():
+            self._request_build("ebook")
+    
+    def _generate_draft(self):
         if not self._validate_file_selected():
             return
+        answer = simpledialog.askstring(
+            "Borrador",
+            "Capítulos a compilar (ej. 3 5).\nDéjalo vacío para compilar los modificados.",
+            parent=self.root)
+        if answer is None:
+            return
+        try:
+            chapters = [int(number) for number in answer.replace(",", " ").split()]
+        except ValueError:
+            self._set_status("Números de capítulo no válidos", "error")
+            return
+        self._request_build("draft", chapters)
+    
+    def _request_build(self, kind, chapters=None):
         output_folder = self._get_output_folder()
-        if output_folder:
-            self._save_current_content()
-            Thread(target=self._run_generate_ebook, args=(output_folder,), daemon=True).start()
+        if not output_folder:
+            return
+        job = BuildJob(kind, self.BUILD_JOBS[kind][0], output_folder, self._take_snapshot(), chapters)
+        
+        for pending in self.build_queue:
+            if pending.covers(job):
+                pending.snapshot = BuildJob.merge_snapshots(pending.snapshot, job.snapshot)
+                self._set_status(f"{job.label}: ya hay una compilación en cola para {output_folder.name}")
+                return
+        running = self._running_job
+        if running is not None and running.covers(job) and running.snapshot[0] == job.snapshot[0]:
+            if job.snapshot[2] is not None:
+                self._start_save(job.snapshot, "Archivo guardado")
+            self._set_status(f"{job.label}: ya se está compilando este contenido en {output_folder.name}")
+            return
+        
+        for pending in [pending for pending in self.build_queue if job.covers(pending)]:
+            job.snapshot = BuildJob.merge_snapshots(pending.snapshot, job.snapshot)
+            self.build_queue.remove(pending)
+            self._show_job(pending, "Agrupado")
+        self.build_queue.append(job)
+        self._show_job(job, "En cola")
+        self._start_next_job()
     
-    def _run_process_all(self, output_folder):
-        try:
-            self.root.after(0, lambda: self._start_animation("Procesando"))
-            
-            content = self._get_current_content()
-            processed = self.capitulador.content_processor.process_content(content)
-            
-            latex_file = output_folder / f"{self.book_settings.ALIAS}.tex"
-            pdf_file = output_folder / f"{self.book_settings.ALIAS}.pdf"
-            azw3_file = output_folder / f"{self.book_settings.ALIAS}.azw3"
-            
-            latex_content = self.capitulador.latex_converter.convert_to_latex(processed)
-            complete_latex = self.capitulador.latex_converter.create_complete_latex_document(latex_content)
-            self.capitulador.file_handler.write_file(str(latex_file), complete_latex)
-            
-            subprocess.run(["pdflatex", "-output-directory", str(output_folder), str(latex_file)], 
-                         check=True, capture_output=True, text=True)
-            
-            chapters_folder = output_folder / "chapters"
-            chapters_folder.mkdir(exist_ok=True)
-            count = self._generate_chapters_in_folder(processed, chapters_folder)
-            
-            subprocess.run(["ebook-convert", str(pdf_file), str(azw3_file)], 
-                         check=True, capture_output=True, text=True)
-            
-            manuscript_dest = output_folder / "manuscript.txt"
-            with open(self.file_path, 'r', encoding='utf-8') as src, \
-                 open(manuscript_dest, 'w', encoding='utf-8') as dst:
-                dst.write(src.read())
-            
-            self._cleanup_files(output_folder)
-            
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"Completado: PDF, eBook, {count} capítulos", "success"))
-        except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"Error: {error_msg}", "error"))
+    def _start_next_job(self):
+        if self._running_job is not None or not self.build_queue:
+            return
+        job = self._running_job = self.build_queue.pop(0)
+        self._show_job(job, "En curso")
+        Thread(target=self._run_job, args=(job,), daemon=True).start()
     
-    def _run_generate_pdf(self, output_folder):
+    def _run_job(self, job):
+        label, progress, error_prefix, method = self.BUILD_JOBS[job.kind]
+        self.root.after(0, lambda: self._start_animation(progress))
         try:
-            self.root.after(0, lambda: self._start_animation("Generando PDF"))
-            
-            content = self._get_current_content()
-            processed = self.capitulador.content_processor.process_content(content)
-            latex_content = self.capitulador.latex_converter.convert_to_latex(processed)
-            complete_latex = self.capitulador.latex_converter.create_complete_latex_document(latex_content)
-            
-            latex_file = output_folder / f"{self.book_settings.ALIAS}.tex"
-            self.capitulador.file_handler.write_file(str(latex_file), complete_latex)
-            
-            subprocess.run(["pdflatex", "-output-directory", str(output_folder), str(latex_file)], 
-                         check=True, capture_output=True, text=True)
-            
-            self._cleanup_files(output_folder)
-            
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status("PDF generado correctamente", "success"))
+            with job.token.activate():
+                message = getattr(self, method)(job)
+            status, status_type = "Completado", "success"
         except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"Error generando PDF: {error_msg}", "error"))
+            if job.token.cancelled:
+                status, status_type, message = "Cancelado", "normal", f"{label}: compilación cancelada"
+            else:
+                status, status_type, message = "Fallido", "error", f"{error_prefix}: {e}"
+        self.root.after(0, lambda: self._finish_job(job, status, message, status_type))
     
-    def _run_generate_chapters(self, output_folder):
-        try:
-            self.root.after(0, lambda: self._start_animation("Generando capítulos"))
-            
-            content = self._get_current_content()
-            processed = self.capitulador.content_processor.process_content(content)
-            
-            chapters_folder = output_folder / "chapters"
-            chapters_folder.mkdir(exist_ok=True)
-            count = self._generate_chapters_in_folder(processed, chapters_folder)
-            
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"{count} capítulos generados", "success"))
-        except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"Error generando capítulos: {error_msg}", "error"))
+    def _finish_job(self, job, status, message, status_type):
+        self._stop_animation()
+        self._set_status(message, status_type)
+        self._show_job(job, status)
+        self._running_job = None
+        self._start_next_job()
     
-    def _run_generate_ebook(self, output_folder):
-        try:
-            self.root.after(0, lambda: self._start_animation("Generando eBook"))
+    def _cancel_builds(self):
+        if self._running_job is None and not self.build_queue:
+            self._set_status("No hay compilaciones en curso")
+            return
+        for job in self.build_queue:
+            if job.snapshot[2] is not None:
+                self._start_save(job.snapshot, "Archivo guardado")
+            self._show_job(job, "Cancelado")
+        self.build_queue.clear()
+        if self._running_job is not None:
+            self._show_job(self._running_job, "Cancelando")
+            Thread(target=self._running_job.token.cancel, daemon=True).start()
+    
+    def _show_job(self, job, status):
+        job.status = status
+        if job.item is None:
+            job.item = self.jobs_tree.insert("", tk.END, text=f"{job.label} → {job.output_folder.name}", values=(status,))
+            items = self.jobs_tree.get_children()
+            if len(items) > self.MAX_JOB_HISTORY:
+                self.jobs_tree.delete(*items[:len(items) - self.MAX_JOB_HISTORY])
+        elif self.jobs_tree.exists(job.item):
+            self.jobs_tree.item(job.item, values=(status,))
+    
+    def _run_process_all(self, job):
+        output_folder = job.output_folder
+        manuscript = self._load_snapshot(job.snapshot)
+        
+        latex_file = output_folder / f"{self.book_settings.ALIAS}.tex"
+        epub_file = output_folder / f"{self.book_settings.ALIAS}.epub"
+        azw3_file = output_folder / f"{self.book_settings.ALIAS}.azw3"
+        chapters_folder = output_folder / "chapters"
+        artifacts = {
+            "book.tex": str(latex_file),
+            "book.pdf": str(output_folder / f"{self.book_settings.ALIAS}.pdf"),
+            "book.epub": str(epub_file),
+            "book.azw3": str(azw3_file),
+            "chapters": str(chapters_folder),
+        }
+        
+        build_client = BuildClient()
+        build_cache = self.capitulador.build_cache
+        fingerprint = build_cache.fingerprint(manuscript, self.book_settings, "gui")
+        if build_client.is_available():
+            build_client.build(
+                {"content": manuscript.text, "output": str(output_folder)},
+                lambda event: self._show_server_event(event))
+            count = len(list(chapters_folder.glob("chapter*.txt")))
+        elif build_cache.restore(fingerprint, artifacts):
+            count = len(list(chapters_folder.glob("chapter*.txt")))
+        else:
+            build_cache.detach(artifacts)
+            processed = self.capitulador.content_processor.process_content(manuscript.text)
             
-            content = self._get_current_content()
-            processed = self.capitulador.content_processor.process_content(content)
-            latex_content = self.capitulador.latex_converter.convert_to_latex(processed)
+            latex_content = self.capitulador.latex_converter.convert_chapters(processed)
             complete_latex = self.capitulador.latex_converter.create_complete_latex_document(latex_content)
-            
-            latex_file = output_folder / f"{self.book_settings.ALIAS}.tex"
-            pdf_file = output_folder / f"{self.book_settings.ALIAS}.pdf"
-            azw3_file = output_folder / f"{self.book_settings.ALIAS}.azw3"
-            
             self.capitulador.file_handler.write_file(str(latex_file), complete_latex)
+            job.token.check()
             
-            subprocess.run(["pdflatex", "-output-directory", str(output_folder), str(latex_file)], 
-                         check=True, capture_output=True, text=True)
-            subprocess.run(["ebook-convert", str(pdf_file), str(azw3_file)], 
-                         check=True, capture_output=True, text=True)
+            self.capitulador.pdf_generator.generate_pdf(str(latex_file), str(output_folder))
             
-            self._cleanup_files(output_folder)
+            count = self._generate_chapters_in_folder(manuscript, chapters_folder)
             
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status("eBook generado correctamente", "success"))
-        except Exception as e:
-            error_msg = str(e)
-            self.root.after(0, lambda: self._stop_animation())
-            self.root.after(0, lambda: self._set_status(f"Error generando eBook: {error_msg}", "error"))
-    
-    def _generate_chapters_in_folder(self, content, chapters_folder):
-        chapter_count = 0
-        chapters = re.split(r'# Chapter \d+', content)
-        
-        if len(chapters) > 1:
-            chapters = chapters[1:]
-            for i, chapter_content in enumerate(chapters, 1):
-                if chapter_content.strip():
-                    chapter_file = chapters_folder / f"chapter{i}.txt"
-                    with open(chapter_file, 'w', encoding='utf-8') as f:
-                        f.write(f"# Chapter {i}\n{chapter_content.strip()}")
-                    chapter_count += 1
-        
-        return chapter_count
+            self._convert_ebook(processed, epub_file, azw3_file)
+            build_cache.store(fingerprint, artifacts)
+        
+        manuscript_dest = output_folder / "manuscript.txt"
+        with open(manuscript_dest, 'wb') as dst:
+            dst.write(manuscript.data)
+        
+        self._cleanup_files(output_folder)
+        self._mark_built(manuscript)
+        return f"Completado: PDF, eBook, {count} capítulos"
+    
+    def _show_server_event(self, event):
+        if event["event"] == "queued":
+            text = "En cola en el servidor"
+        elif event["event"] == "stage" and event["status"] == "iniciada":
+            text = f"Servidor: {event['stage']}"
+        else:
+            return
+        self.root.after(0, lambda: (self._stop_animation(), self._start_animation(text)))
+    
+    def _run_generate_pdf(self, job):
+        manuscript = self._load_snapshot(job.snapshot)
+        processed = self.capitulador.content_processor.process_content(manuscript.text)
+        latex_content = self.capitulador.latex_converter.convert_chapters(processed)
+        complete_latex = self.capitulador.latex_converter.create_complete_latex_document(latex_content)
+        
+        latex_file = job.output_folder / f"{self.book_settings.ALIAS}.tex"
+        self.capitulador.file_handler.write_file(str(latex_file), complete_latex)
+        job.token.check()
+        
+        self.capitulador.pdf_generator.generate_pdf(str(latex_file), str(job.output_folder))
+        
+        self._cleanup_files(job.output_folder)
+        self._mark_built(manuscript)
+        return "PDF generado correctamente"
+    
+    def _run_generate_chapters(self, job):
+        manuscript = self._load_snapshot(job.snapshot)
+        count = self._generate_chapters_in_folder(manuscript, job.output_folder / "chapters")
+        self._mark_built(manuscript)
+        return f"{count} capítulos generados"
+    
+    def _run_generate_ebook(self, job):
+        manuscript = self._load_snapshot(job.snapshot)
+        processed = self.capitulador.content_processor.process_content(manuscript.text)
+        
+        epub_file = job.output_folder / f"{self.book_settings.ALIAS}.epub"
+        azw3_file = job.output_folder / f"{self.book_settings.ALIAS}.azw3"
+        self._convert_ebook(processed, epub_file, azw3_file)
+        self._mark_built(manuscript)
+        return "eBook generado correctamente"
+    
+    def _convert_ebook(self, processed, epub_file, azw3_file):
+        ebook_converter = self.capitulador.ebook_converter
+        ebook_converter.convert_to_epub(processed, str(epub_file), self.book_settings)
+        ebook_converter.convert_to_ebook(str(epub_file), str(azw3_file), self.book_settings)
+    
+    def _run_generate_draft(self, job):
+        manuscript = self._load_snapshot(job.snapshot)
+        draft_builder = DraftBuilder(str(job.output_folder / "draft"))
+        compiled = draft_builder.build(manuscript, job.chapters or None)
+        
+        if compiled:
+            return f"Borrador generado: capítulos {', '.join(map(str, compiled))}"
+        return "Borrador al día: ningún capítulo modificado"
+    
+    def _generate_chapters_in_folder(self, manuscript, chapters_folder):
+        return ChapterGenerator.write_chapters(str(chapters_folder), manuscript.chapters())
     
     def run(self):
         self.root.mainloop()
@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import random
+import sys
+import time
+from pathlib import Path
+
+from capitulador import ContentProcessor, LatexConverter, MarkdownLatexConverter
+
+SAMPLE_CHAPTERS = [
+    "# Chapter 1\n\n## El comienzo\n\nEra una noche *oscura* y _tormentosa_; el viento --según dicen-- soplaba.",
+    "# Chapter 2\n\n## ¿Quién llama?\n\n—¿Quién es? —preguntó Ana.\n\n—Nadie… —respondió «el otro».",
+    "# Chapter 3\n\n## Dup\n\n## Dup\n\nUn 50% de las veces & sin #etiquetas ni {llaves}.",
+    "# Chapter 4\n\n## 1. Números primero\n\n\"Comillas\" y “curvas”, l'apóstrofo y **negrita**.",
+    "# Chapter 5\n\n## Ñandú y Über\n\nTexto\ncon saltos\nde línea suaves.\n\n\\newpage\n\n\\vspace{12pt}",
+    "# Chapter 6\n\n- una lista\n- que no es compatible",
+    "# Chapter 7\n\nUn `código` y un [enlace](http://example.com) van a pandoc.",
+    "# Chapter 8\n\n## El Sr. Gil\n\nVino el Sr. García a la p. 5 con el Dr. Ruiz (Sr. X) y e.g. algo.\n"
+    "Llegó el Sr.\nPi, el x_Sr. y y el Dr. ",
+    "# Chapter 9\n\n## El *río* y {llaves}\n\n## Un **mar**\n\nTexto.",
+]
+WORDS = ["el", "río", "*luz*", "_viento_", "¡sí!", "¿qué?", "50%", "ñandú,", "casa", "—dijo—", "“cita”",
+         "l'eau", "a&b", "**fuerte**", "x_y", "...", "--", "sombra", "camino", "áéí", "noche", "Sr.", "p.",
+         "Dr.", "No.", "i.e."]
+RANDOM_SAMPLES = 200
+
+
+def random_chapter(generator, number):
+    paragraphs = [f"# Chapter {number}", f"## Título {generator.choice(WORDS).strip('*_')}"]
+    for _ in range(generator.randint(1, 6)):
+        paragraphs.append(" ".join(generator.choice(WORDS) for _ in range(generator.randint(1, 90))))
+    return "\n\n".join(paragraphs)
+
+
+def load_corpus(paths):
+    corpus = list(SAMPLE_CHAPTERS)
+    generator = random.Random(0)
+    corpus.extend(random_chapter(generator, number) for number in range(RANDOM_SAMPLES))
+    for path in map(Path, paths):
+        files = sorted(path.rglob("*.txt")) + sorted(path.rglob("*.md")) if path.is_dir() else [path]
+        for file in files:
+            text = file.read_text(encoding="utf-8")
+            corpus.extend(LatexConverter.split_chapters(text))
+            corpus.extend(LatexConverter.split_chapters(ContentProcessor.process_content(text)))
+    return corpus
+
+
+def run_harness(paths):
+    corpus = load_corpus(paths)
+    native_count = fallback_count = 0
+    native_time = pandoc_time = 0.0
+    mismatches = []
+
+    for chunk in corpus:
+        start = time.perf_counter()
+        native = MarkdownLatexConverter.convert(chunk)
+        native_time += time.perf_counter() - start
+        if native is None:
+            fallback_count += 1
+            continue
+
+        start = time.perf_counter()
+        expected = LatexConverter._run_pandoc(chunk)
+        pandoc_time += time.perf_counter() - start
+        native_count += 1
+        if native != expected:
+            mismatches.append((chunk, native, expected))
+
+    print(f"Fragmentos: {len(corpus)} ({native_count} nativos, {fallback_count} a pandoc)")
+    if native_count:
+        print(f"Nativo: {native_time / len(corpus) * 1e6:.0f} µs/fragmento, "
+              f"pandoc: {pandoc_time / native_count * 1e3:.1f} ms/fragmento")
+
+    if mismatches:
+        for chunk, native, expected in mismatches[:5]:
+            print(f"\n❌ Diferencia en:\n{chunk[:200]}\n--- nativo ---\n{native}\n--- pandoc ---\n{expected}")
+        print(f"\n❌ {len(mismatches)} fragmentos difieren de pandoc.")
+        sys.exit(1)
+    print("\n✅ Salida idéntica a pandoc.")
+
+
+if __name__ == "__main__":
+    run_harness(sys.argv[1:])
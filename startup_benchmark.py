@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+
+import subprocess
+import sys
+from pathlib import Path
+
+BUDGETS_MS = {"capitulador": 150, "gui": 250}
+CONSTRUCTION_BUDGET_MS = 20
+LAZY_MODULES = ["panflute", "pydantic", "pydantic_settings"]
+RUNS = 5
+
+
+def measure_import(module):
+    project_root = Path(__file__).parent
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=project_root, capture_output=True, text=True, check=True)
+
+    imported = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if cumulative.strip().isdigit():
+            imported[name.strip()] = int(cumulative.strip())
+    return imported[module] / 1000, set(imported)
+
+
+def measure_construction():
+    # La ventana vacía del GUI crea un Capitulador: tampoco debe cargar la configuración.
+    code = (
+        "import sys, time\n"
+        "from capitulador import Capitulador\n"
+        "start = time.perf_counter()\n"
+        "Capitulador()\n"
+        "print((time.perf_counter() - start) * 1000)\n"
+        "print(' '.join(sys.modules))")
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=Path(__file__).parent, capture_output=True, text=True, check=True)
+    elapsed, modules = result.stdout.splitlines()
+    return float(elapsed), set(modules.split())
+
+
+def run_benchmark():
+    failures = []
+
+    for module, budget in BUDGETS_MS.items():
+        timings = []
+        imported = set()
+        for _ in range(RUNS):
+            elapsed, imported = measure_import(module)
+            timings.append(elapsed)
+        best = min(timings)
+        print(f"{module}: {best:.1f} ms (límite {budget} ms)")
+
+        if best > budget:
+            failures.append(f"{module} tarda {best:.1f} ms en importarse (límite {budget} ms)")
+        for lazy_module in LAZY_MODULES:
+            if lazy_module in imported:
+                failures.append(f"{module} importa {lazy_module} al arrancar")
+
+    timings = []
+    imported = set()
+    for _ in range(RUNS):
+        elapsed, imported = measure_construction()
+        timings.append(elapsed)
+    best = min(timings)
+    print(f"Capitulador(): {best:.1f} ms (límite {CONSTRUCTION_BUDGET_MS} ms)")
+    if best > CONSTRUCTION_BUDGET_MS:
+        failures.append(f"Capitulador() tarda {best:.1f} ms en construirse (límite {CONSTRUCTION_BUDGET_MS} ms)")
+    for lazy_module in LAZY_MODULES:
+        if lazy_module in imported:
+            failures.append(f"Capitulador() importa {lazy_module} al construirse")
+
+    if failures:
+        for failure in failures:
+            print(f"❌ {failure}")
+        sys.exit(1)
+    print("\n✅ Arranque dentro del presupuesto.")
+
+
+if __name__ == "__main__":
+    run_benchmark()